@@ -0,0 +1,85 @@
+import sys
+import threading
+
+STATUS_OK = "ok"
+STATUS_UNVERIFIED = "unverified"
+STATUS_FAILED = "failed"
+
+
+class CertRecord:
+    # 用 __slots__ 取代 dict，每筆 subdomain 只佔固定幾個欄位
+    __slots__ = ("host", "domain", "enabled", "expire_at", "fingerprint", "status")
+
+    def __init__(self, host, domain, enabled=True):
+        self.host = sys.intern(host)
+        self.domain = sys.intern(domain)
+        self.enabled = enabled
+        self.expire_at = None
+        self.fingerprint = None
+        self.status = None
+
+
+class FleetSnapshot:
+    """整個 fleet 的記憶體快照，由排程、/check 與查詢指令共用。"""
+
+    def __init__(self):
+        self.records = {}
+        self.by_host = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.records)
+
+    def _records_for(self, domain_data):
+        domain = domain_data["domain"]
+        for subdomain_dict in domain_data.get("subdomains", []):
+            key = (domain, subdomain_dict["name"])
+            record = self.records.get(key)
+            if record is None:
+                record = CertRecord(subdomain_dict["name"], domain)
+            record.enabled = subdomain_dict.get("enable") == True
+            yield key, record
+
+    def load(self, domains_data):
+        # 重新載入時保留既有紀錄的探測狀態
+        records = {}
+        by_host = {}
+        with self.lock:
+            for domain_data in domains_data:
+                for key, record in self._records_for(domain_data):
+                    records[key] = record
+                    by_host.setdefault(record.host, []).append(record)
+            self.records = records
+            self.by_host = by_host
+
+    def merge(self, domain_data):
+        # 串流巡檢時逐筆併入快照，不會移除其他 domain 的紀錄
+        with self.lock:
+            for key, record in self._records_for(domain_data):
+                if key not in self.records:
+                    self.records[key] = record
+                    self.by_host.setdefault(record.host, []).append(record)
+
+    def enabled_entries(self):
+        with self.lock:
+            return [
+                (record.domain, record.host)
+                for record in self.records.values()
+                if record.enabled
+            ]
+
+    def record_probe(self, host, expire_at, fingerprint, status):
+        if fingerprint is not None:
+            fingerprint = bytes.fromhex(fingerprint)
+        with self.lock:
+            for record in self.by_host.get(host, ()):
+                record.expire_at = expire_at
+                record.fingerprint = fingerprint
+                record.status = status
+
+    def domains(self):
+        with self.lock:
+            grouped = {}
+            for record in self.records.values():
+                grouped.setdefault(record.domain, []).append(record)
+            return grouped
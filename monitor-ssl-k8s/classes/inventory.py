@@ -0,0 +1,389 @@
+import logging
+import os
+import threading
+import time
+from bson import json_util
+from pymongo.errors import OperationFailure, PyMongoError
+
+# 以下錯誤代表這個部署不支援 change stream（非 replica set 或版本過舊），改用輪詢
+CHANGE_STREAM_UNSUPPORTED = {40573, 40324}
+# resume token 已超出 oplog 範圍，只能重新載入整份清單
+CHANGE_STREAM_HISTORY_LOST = {286, 280, 260}
+
+INVENTORY_PROJECTIONS = {
+    "embedded": {"domain": 1, "subdomains": 1},
+    "flat": {"domain": 1, "name": 1, "enable": 1},
+}
+
+MODE_CHANGE_STREAM = "change_stream"
+MODE_POLLING = "polling"
+
+
+class DomainInventory:
+    """
+    常駐記憶體的 domain 清單：啟動時載入一次，之後由 change stream 持續更新。
+
+    resume token 與清單會定期寫入 snapshot 檔，重啟後從 token 接續而不必重新掃描；
+    部署不支援 change stream 時改為定期整份讀取並比對差異。
+    """
+
+    def __init__(
+        self,
+        collection,
+        layout="embedded",
+        mode=MODE_CHANGE_STREAM,
+        poll_seconds=60,
+        snapshot_path=None,
+        snapshot_seconds=30,
+        retry_seconds=5,
+    ):
+        self.collection = collection
+        self.layout = "flat" if layout == "flat" else "embedded"
+        self.mode = mode
+        self.poll_seconds = poll_seconds
+        self.snapshot_path = snapshot_path
+        self.snapshot_seconds = snapshot_seconds
+        self.retry_seconds = retry_seconds
+        self.projection = INVENTORY_PROJECTIONS[self.layout]
+        self.documents = {}
+        self.resume_token = None
+        self.version = 0
+        self.views = None
+        self.lock = threading.RLock()
+        self.ready = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.saved_at = 0
+        self.full_loads = 0
+        self.events = 0
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.save_snapshot(force=True)
+
+    def wait_ready(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    def run(self):
+        if self.mode == MODE_CHANGE_STREAM:
+            self.load_snapshot()
+        while not self.stopped.is_set():
+            try:
+                if self.mode == MODE_POLLING:
+                    self.poll()
+                    self.stopped.wait(self.poll_seconds)
+                else:
+                    self.watch()
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAM_UNSUPPORTED:
+                    self.logger.warning(f"無法使用 change stream，改為每 {self.poll_seconds} 秒輪詢: {e}")
+                    self.mode = MODE_POLLING
+                elif e.code in CHANGE_STREAM_HISTORY_LOST:
+                    self.logger.warning(f"resume token 已失效，重新載入 domain 清單: {e}")
+                    self.resume_token = None
+                else:
+                    self.logger.error(f"domain 清單同步失敗: {e}")
+                    self.stopped.wait(self.retry_seconds)
+            except PyMongoError as e:
+                # 連線中斷時保留 resume token，恢復後從中斷處接續
+                self.logger.error(f"domain 清單同步失敗: {e}")
+                self.stopped.wait(self.retry_seconds)
+
+    def fetch(self, query=None):
+        return {
+            document["_id"]: document
+            for document in self.collection.find(query or {}, self.projection)
+        }
+
+    def load(self):
+        documents = self.fetch()
+        with self.lock:
+            self.documents = documents
+            self.changed()
+            self.full_loads += 1
+        self.ready.set()
+        self.logger.info(f"已載入 domain 清單，共 {len(documents)} 份文件")
+
+    def poll(self):
+        documents = self.fetch()
+        with self.lock:
+            if documents != self.documents:
+                self.documents = documents
+                self.changed()
+            self.full_loads += 1
+        self.ready.set()
+
+    def watch(self):
+        options = {"full_document": "updateLookup", "max_await_time_ms": 1000}
+        if self.resume_token is not None:
+            options["resume_after"] = self.resume_token
+        with self.collection.watch(**options) as stream:
+            # 先開 stream 再載入，載入期間的變更會在之後的事件中補上
+            if self.resume_token is None:
+                self.load()
+            self.ready.set()
+            while not self.stopped.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is not None and not self.apply_change(change):
+                    # collection 被刪除或改名，舊 token 不能再用，重新載入
+                    self.resume_token = None
+                    return
+                self.resume_token = stream.resume_token
+                self.save_snapshot()
+
+    def apply_change(self, change):
+        # 回傳 False 代表 stream 已失效
+        operation = change["operationType"]
+        if operation in ("drop", "rename", "dropDatabase", "invalidate"):
+            return False
+        key = change.get("documentKey", {}).get("_id")
+        with self.lock:
+            if operation == "delete":
+                self.documents.pop(key, None)
+            elif operation in ("insert", "update", "replace"):
+                document = change.get("fullDocument")
+                # 文件在查詢 fullDocument 前已被刪除，稍後會收到 delete 事件
+                if document is None:
+                    return True
+                self.documents[key] = {
+                    field: document[field]
+                    for field in ("_id", *self.projection)
+                    if field in document
+                }
+            else:
+                return True
+            self.events += 1
+            self.changed()
+        return True
+
+    def reload(self, domains):
+        """寫入後立即重新讀取受影響的 domain，不必等 change stream 事件。"""
+        domains = [domain for domain in dict.fromkeys(domains) if domain]
+        if not domains or not self.ready.is_set():
+            return
+        documents = self.fetch({"domain": {"$in": domains}})
+        with self.lock:
+            for key in [
+                key
+                for key, document in self.documents.items()
+                if document.get("domain") in domains
+            ]:
+                del self.documents[key]
+            self.documents.update(documents)
+            self.changed()
+
+    def changed(self):
+        self.version += 1
+        self.views = None
+
+    def get_views(self):
+        with self.lock:
+            if self.views is not None:
+                return self.views
+            by_domain = {}
+            for document in self.documents.values():
+                domain = document.get("domain")
+                if not domain:
+                    continue
+                if self.layout == "flat":
+                    by_domain.setdefault(domain, []).append(
+                        {"name": document["name"], "enable": document.get("enable")}
+                    )
+                else:
+                    by_domain.setdefault(domain, []).extend(
+                        document.get("subdomains", [])
+                    )
+            if self.layout == "flat":
+                for subdomains in by_domain.values():
+                    subdomains.sort(key=lambda item: item["name"])
+            domains = [
+                {"domain": domain, "subdomains": by_domain[domain]}
+                for domain in sorted(by_domain)
+            ]
+            by_subdomain = {}
+            for domain_data in domains:
+                for item in domain_data["subdomains"]:
+                    by_subdomain.setdefault(item["name"], (domain_data["domain"], item))
+            self.views = (domains, by_domain, by_subdomain)
+            return self.views
+
+    def get_all_domains(self):
+        return self.get_views()[0]
+
+    def get_domain(self, domain):
+        subdomains = self.get_views()[1].get(domain)
+        if subdomains is None:
+            return None
+        return {"domain": domain, "subdomains": subdomains}
+
+    def get_subdomain(self, subdomain):
+        entry = self.get_views()[2].get(subdomain)
+        if entry is None:
+            return None
+        domain, item = entry
+        return {"subdomain": subdomain, "domain": domain, "enable": item.get("enable")}
+
+    def domains_of(self, subdomains):
+        by_subdomain = self.get_views()[2]
+        return [by_subdomain[s][0] for s in subdomains if s in by_subdomain]
+
+    def load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json_util.loads(f.read())
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"讀取 domain 清單 snapshot 失敗: {e}")
+            return False
+        if snapshot.get("layout") != self.layout or not snapshot.get("resume_token"):
+            return False
+        with self.lock:
+            self.documents = {
+                document["_id"]: document for document in snapshot["documents"]
+            }
+            self.resume_token = snapshot["resume_token"]
+            self.changed()
+        self.ready.set()
+        self.logger.info(f"從 snapshot 載入 domain 清單，共 {len(self.documents)} 份文件")
+        return True
+
+    def save_snapshot(self, force=False):
+        if not self.snapshot_path or self.resume_token is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.saved_at < self.snapshot_seconds:
+            return
+        with self.lock:
+            snapshot = json_util.dumps(
+                {
+                    "layout": self.layout,
+                    "resume_token": self.resume_token,
+                    "documents": list(self.documents.values()),
+                }
+            )
+        # 先寫暫存檔再改名，重啟時不會讀到寫一半的檔案
+        temp_path = f"{self.snapshot_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(snapshot)
+        os.replace(temp_path, self.snapshot_path)
+        self.saved_at = now
+
+    def stats(self):
+        with self.lock:
+            return {
+                "mode": self.mode,
+                "ready": self.ready.is_set(),
+                "documents": len(self.documents),
+                "version": self.version,
+                "events": self.events,
+                "full_loads": self.full_loads,
+            }
+
+
+class InventoryRepo:
+    """讀取一律由 DomainInventory 回答，寫入交給原本的 repo 並立即更新受影響的 domain。"""
+
+    def __init__(self, repo, inventory):
+        self.repo = repo
+        self.inventory = inventory
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.repo, name)
+
+    def _ready(self):
+        # 清單還沒載入完成前直接查 MongoDB
+        if self.inventory.ready.is_set():
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def stats(self):
+        stats = dict(self.inventory.stats(), hits=self.hits, misses=self.misses)
+        if hasattr(self.repo, "stats"):
+            stats["fallback_cache"] = self.repo.stats()
+        return stats
+
+    def get_domain_from_mongodb(self, domain):
+        if self._ready():
+            return self.inventory.get_domain(domain)
+        return self.repo.get_domain_from_mongodb(domain)
+
+    def get_subdomain_data_from_mongodb(self, subdomain):
+        if self._ready():
+            return self.inventory.get_subdomain(subdomain)
+        return self.repo.get_subdomain_data_from_mongodb(subdomain)
+
+    def get_all_domains_from_mongodb(self):
+        if self._ready():
+            return self.inventory.get_all_domains()
+        return self.repo.get_all_domains_from_mongodb()
+
+    def iter_domains_from_mongodb(self, batch_size=500):
+        if self._ready():
+            return iter(self.inventory.get_all_domains())
+        return self.repo.iter_domains_from_mongodb(batch_size)
+
+    def _write(self, write, domains=(), subdomains=()):
+        # 在寫入前先查出 subdomain 所屬的 domain，刪除後就查不到了
+        domains = list(domains) + self.inventory.domains_of(subdomains)
+        try:
+            return write()
+        finally:
+            self.inventory.reload(domains)
+
+    def add_subdomain_to_mongodb(self, domain, subdomain):
+        return self._write(
+            lambda: self.repo.add_subdomain_to_mongodb(domain, subdomain), [domain]
+        )
+
+    def bulk_add_subdomains_to_mongodb(self, subdomains_by_domain):
+        return self._write(
+            lambda: self.repo.bulk_add_subdomains_to_mongodb(subdomains_by_domain),
+            subdomains_by_domain,
+        )
+
+    def apply_subdomain_changes(self, changes):
+        return self._write(
+            lambda: self.repo.apply_subdomain_changes(changes), changes
+        )
+
+    def update_subdomain_in_mongodb(self, domain, origin_subdomain, new_subdomain):
+        return self._write(
+            lambda: self.repo.update_subdomain_in_mongodb(
+                domain, origin_subdomain, new_subdomain
+            ),
+            [domain],
+        )
+
+    def delete_subdomain(self, subdomain_to_delete):
+        return self._write(
+            lambda: self.repo.delete_subdomain(subdomain_to_delete),
+            subdomains=[subdomain_to_delete],
+        )
+
+    def save_domains_to_mongodb(self, domain, subdomain):
+        return self._write(
+            lambda: self.repo.save_domains_to_mongodb(domain, subdomain), [domain]
+        )
+
+    def disable_subdomain(self, subdomain):
+        return self._write(
+            lambda: self.repo.disable_subdomain(subdomain), subdomains=[subdomain]
+        )
+
+    def enable_subdomain(self, subdomain):
+        return self._write(
+            lambda: self.repo.enable_subdomain(subdomain), subdomains=[subdomain]
+        )
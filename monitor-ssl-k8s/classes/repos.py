@@ -1,6 +1,18 @@
 import logging
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+import threading
+from collections import OrderedDict
+from itertools import groupby
+from pymongo import (
+    ASCENDING,
+    ReturnDocument,
+    DeleteMany,
+    IndexModel,
+    MongoClient,
+    ReplaceOne,
+    UpdateMany,
+    UpdateOne,
+)
+from pymongo.errors import ConnectionFailure, DuplicateKeyError, OperationFailure
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,14 +35,68 @@ def get_collection(mongo_client, collection_name):
     return collection
 
 
+def create_indexes(collection, indexes, logger):
+    """
+    逐一建立索引，其中一個失敗不影響其他索引。
+    唯一索引建立失敗（通常是已有重複資料）時拋出例外，讓啟動流程直接中止而不是只留一行 log。
+    """
+    # create_indexes 對已存在且定義相同的索引不會重建，每次啟動呼叫即可
+    names = []
+    failed_unique = []
+    for index in indexes:
+        name = index.document["name"]
+        try:
+            names.extend(collection.create_indexes([index]))
+        except OperationFailure as e:
+            logger.error(f"建立 MongoDB 索引 {name} 失敗: {e}")
+            if index.document.get("unique"):
+                failed_unique.append(f"{name}: {e}")
+    if names:
+        logger.info(f"MongoDB 索引已就緒: {', '.join(names)}")
+    if failed_unique:
+        raise Exception(
+            f"{collection.name} 的唯一索引建立失敗，請先清除重複的資料: {'; '.join(failed_unique)}"
+        )
+    return names
+
+
+DOMAIN_INDEXES = [
+    # 只對有 domain 欄位的文件建立唯一索引，避免舊的 platform 文件互相衝突
+    IndexModel(
+        [("domain", ASCENDING)],
+        name="domain_unique",
+        unique=True,
+        partialFilterExpression={"domain": {"$type": "string"}},
+    ),
+    IndexModel([("subdomains.name", ASCENDING)], name="subdomains_name"),
+]
+
+DOMAIN_PROJECTION = {"_id": 0, "domain": 1, "subdomains": 1}
+
+SUBDOMAIN_INDEXES = [
+    # (domain, name) 同時負責唯一性、單一 domain 的查詢與依 domain 排序的串流讀取
+    IndexModel(
+        [("domain", ASCENDING), ("name", ASCENDING)],
+        name="domain_name_unique",
+        unique=True,
+    ),
+    IndexModel([("name", ASCENDING)], name="name"),
+]
+
+SUBDOMAIN_PROJECTION = {"_id": 0, "domain": 1, "name": 1, "enable": 1}
+
+
 class DomainRepo:
     def __init__(self, collection):
         self.collection = collection
         self.logger = logging.getLogger(__name__)
 
+    def ensure_indexes(self):
+        return create_indexes(self.collection, DOMAIN_INDEXES, self.logger)
+
     def get_domain_from_mongodb(self, domain):
         query = {"domain": domain}
-        result = self.collection.find_one(query)
+        result = self.collection.find_one(query, {"_id": 0, "subdomains": 1})
 
         if result:
             self.logger.info(f"找到 '{domain}' 的訊息。")
@@ -40,14 +106,23 @@ class DomainRepo:
             return None
 
     def get_subdomain_data_from_mongodb(self, subdomain):
-        # 使用 MongoDB 的 $elemMatch 來匹配子陣列中的元素
-        query = {"subdomains": {"$elemMatch": {"name": subdomain}}}
-        result = self.collection.find_one(query)
+        # 走 subdomains.name 索引，並用 $elemMatch projection 只取回符合的那一筆 subdomain
+        query = {"subdomains.name": subdomain}
+        projection = {
+            "_id": 0,
+            "domain": 1,
+            "subdomains": {"$elemMatch": {"name": subdomain}},
+        }
+        result = self.collection.find_one(query, projection)
 
         if result:
             # 從結果中提取子域名資訊
             subdomain_info = next(
-                (item for item in result["subdomains"] if item["name"] == subdomain),
+                (
+                    item
+                    for item in result.get("subdomains", [])
+                    if item["name"] == subdomain
+                ),
                 None,
             )
             if subdomain_info:
@@ -70,7 +145,7 @@ class DomainRepo:
     def get_all_domains_from_mongodb(self):
         try:
             domain_envs = []
-            results = self.collection.find({})
+            results = self.collection.find({}, DOMAIN_PROJECTION)
             for item in results:
                 domain = item.get("domain", {})
                 subdomains = item.get("subdomains", [])
@@ -78,8 +153,17 @@ class DomainRepo:
                     domain_envs.append({"domain": domain, "subdomains": subdomains})
             return domain_envs
         except Exception as e:
-            self.logger.info(f"從 MongoDB 讀取資料失敗: {e}")
-            return {}
+            # 讀取失敗要讓呼叫端知道，不能當成空清單，否則排程會以為所有 subdomain 都被移除
+            self.logger.error(f"從 MongoDB 讀取資料失敗: {e}")
+            raise
+
+    def iter_domains_from_mongodb(self, batch_size=500):
+        # 以 generator 逐批讀取，不必一次把整個 collection 載入記憶體
+        results = self.collection.find({}, DOMAIN_PROJECTION, batch_size=batch_size)
+        for item in results:
+            domain = item.get("domain", {})
+            if domain:
+                yield {"domain": domain, "subdomains": item.get("subdomains", [])}
 
     def add_subdomain_to_mongodb(self, domain, subdomain):
         subdomain_info = {"name": subdomain, "enable": True}
@@ -113,6 +197,85 @@ class DomainRepo:
             self.logger.error("添加 subdomain 失敗: %s", str(e))
             raise
 
+    def add_subdomains_operation(self, domain, subdomains):
+        items = [
+            {"name": subdomain, "enable": True} for subdomain in dict.fromkeys(subdomains)
+        ]
+        # 以 pipeline update 在 server 端過濾掉已存在的 name，domain 不存在時直接 upsert
+        new_items = {
+            "$filter": {
+                "input": {"$literal": items},
+                "cond": {
+                    "$not": {
+                        "$in": [
+                            "$$this.name",
+                            {"$ifNull": ["$subdomains.name", []]},
+                        ]
+                    }
+                },
+            }
+        }
+        existing = {"$ifNull": ["$subdomains", []]}
+        return UpdateOne(
+            {"domain": domain},
+            [{"$set": {"subdomains": {"$concatArrays": [existing, new_items]}}}],
+            upsert=True,
+        )
+
+    def bulk_add_subdomains_to_mongodb(self, subdomains_by_domain):
+        """一次 bulk_write 新增多個 domain 下的 subdomain，已存在的 subdomain 保持不變。"""
+        operations = [
+            self.add_subdomains_operation(domain, subdomains)
+            for domain, subdomains in subdomains_by_domain.items()
+        ]
+        if not operations:
+            return None
+        try:
+            return self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            self.logger.error("批量新增 subdomain 失敗: %s", str(e))
+            raise
+
+    def apply_subdomain_changes(self, changes):
+        """
+        changes 為 {domain: {"add": [...], "enable": [...], "disable": [...], "remove": [...]}}，
+        全部變更合併成一次 unordered bulk_write。
+        """
+        operations = []
+        for domain, change in changes.items():
+            if change.get("add"):
+                operations.append(self.add_subdomains_operation(domain, change["add"]))
+            if change.get("enable"):
+                operations.append(
+                    UpdateOne(
+                        {"domain": domain},
+                        {"$set": {"subdomains.$[item].enable": True}},
+                        array_filters=[{"item.name": {"$in": change["enable"]}}],
+                    )
+                )
+            if change.get("disable"):
+                operations.append(
+                    UpdateOne(
+                        {"domain": domain},
+                        {"$set": {"subdomains.$[item].enable": False}},
+                        array_filters=[{"item.name": {"$in": change["disable"]}}],
+                    )
+                )
+            if change.get("remove"):
+                operations.append(
+                    UpdateOne(
+                        {"domain": domain},
+                        {"$pull": {"subdomains": {"name": {"$in": change["remove"]}}}},
+                    )
+                )
+        if not operations:
+            return None
+        try:
+            return self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            self.logger.error("同步 subdomain 失敗: %s", str(e))
+            raise
+
     def write_domain_data_to_mongodb(self, domain_data):
         for platform, envs in domain_data.items():
             document = {"platform": platform, "envs": envs}
@@ -194,3 +357,597 @@ class DomainRepo:
         except Exception as e:
             self.logger.error("enable subdomain 失敗: %s", str(e))
             raise
+
+
+class SubdomainRepo:
+    """
+    一個 subdomain 一份文件的 collection：{"domain": ..., "name": ..., "enable": ...}。
+
+    介面與 DomainRepo 相同，單一 subdomain 的讀寫只動到自己的那份文件。
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.logger = logging.getLogger(__name__)
+
+    def ensure_indexes(self):
+        return create_indexes(self.collection, SUBDOMAIN_INDEXES, self.logger)
+
+    def get_domain_from_mongodb(self, domain):
+        subdomains = [
+            {"name": item["name"], "enable": item.get("enable")}
+            for item in self.collection.find(
+                {"domain": domain}, SUBDOMAIN_PROJECTION
+            ).sort("name", ASCENDING)
+        ]
+        if subdomains:
+            self.logger.info(f"找到 '{domain}' 的訊息。")
+            return {"domain": domain, "subdomains": subdomains}
+        else:
+            self.logger.info(f"未找到 '{domain}' 的訊息。")
+            return None
+
+    def get_subdomain_data_from_mongodb(self, subdomain):
+        result = self.collection.find_one({"name": subdomain}, SUBDOMAIN_PROJECTION)
+        if result:
+            self.logger.info(f"Found subdomain information for '{subdomain}'.")
+            return {
+                "subdomain": subdomain,
+                "domain": result["domain"],
+                "enable": result.get("enable"),
+            }
+        else:
+            self.logger.info(f"No subdomain information found for '{subdomain}'.")
+            return None
+
+    def get_all_domains_from_mongodb(self):
+        try:
+            return list(self.iter_domains_from_mongodb())
+        except Exception as e:
+            self.logger.error(f"從 MongoDB 讀取資料失敗: {e}")
+            raise
+
+    def iter_domains_from_mongodb(self, batch_size=500):
+        # 依 (domain, name) 索引排序，相鄰的文件即屬於同一個 domain，可以邊讀邊組回舊格式
+        results = self.collection.find(
+            {}, SUBDOMAIN_PROJECTION, batch_size=batch_size
+        ).sort([("domain", ASCENDING), ("name", ASCENDING)])
+        for domain, items in groupby(results, key=lambda item: item["domain"]):
+            yield {
+                "domain": domain,
+                "subdomains": [
+                    {"name": item["name"], "enable": item.get("enable")}
+                    for item in items
+                ],
+            }
+
+    def add_subdomain_to_mongodb(self, domain, subdomain):
+        try:
+            result = self.collection.update_one(
+                {"domain": domain, "name": subdomain},
+                {"$setOnInsert": {"enable": True}},
+                upsert=True,
+            )
+            if result.upserted_id is None:
+                self.logger.info(
+                    f"subdomain '{subdomain}' 已存在於 domain '{domain}' 下，不進行新增。"
+                )
+                return False
+            self.logger.info(
+                f"subdomain '{subdomain}' 已成功新增至 domain '{domain}'。"
+            )
+            return True
+        except Exception as e:
+            self.logger.error("添加 subdomain 失敗: %s", str(e))
+            raise
+
+    def bulk_add_subdomains_to_mongodb(self, subdomains_by_domain):
+        """一次 bulk_write 新增多個 domain 下的 subdomain，已存在的 subdomain 保持不變。"""
+        operations = [
+            UpdateOne(
+                {"domain": domain, "name": subdomain},
+                {"$setOnInsert": {"enable": True}},
+                upsert=True,
+            )
+            for domain, subdomains in subdomains_by_domain.items()
+            for subdomain in dict.fromkeys(subdomains)
+        ]
+        if not operations:
+            return None
+        try:
+            return self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            self.logger.error("批量新增 subdomain 失敗: %s", str(e))
+            raise
+
+    def apply_subdomain_changes(self, changes):
+        """
+        changes 為 {domain: {"add": [...], "enable": [...], "disable": [...], "remove": [...]}}，
+        全部變更合併成一次 unordered bulk_write。
+        """
+        operations = []
+        for domain, change in changes.items():
+            for subdomain in dict.fromkeys(change.get("add", [])):
+                operations.append(
+                    UpdateOne(
+                        {"domain": domain, "name": subdomain},
+                        {"$setOnInsert": {"enable": True}},
+                        upsert=True,
+                    )
+                )
+            if change.get("enable"):
+                operations.append(
+                    UpdateMany(
+                        {"domain": domain, "name": {"$in": change["enable"]}},
+                        {"$set": {"enable": True}},
+                    )
+                )
+            if change.get("disable"):
+                operations.append(
+                    UpdateMany(
+                        {"domain": domain, "name": {"$in": change["disable"]}},
+                        {"$set": {"enable": False}},
+                    )
+                )
+            if change.get("remove"):
+                operations.append(
+                    DeleteMany({"domain": domain, "name": {"$in": change["remove"]}})
+                )
+        if not operations:
+            return None
+        try:
+            return self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            self.logger.error("同步 subdomain 失敗: %s", str(e))
+            raise
+
+    def update_subdomain_in_mongodb(self, domain, origin_subdomain, new_subdomain):
+        try:
+            result = self.collection.update_one(
+                {"domain": domain, "name": origin_subdomain},
+                {"$set": {"name": new_subdomain}},
+            )
+            if result.matched_count == 0:
+                self.logger.info(
+                    f"未找到 domain '{domain}' 的 subdomain '{origin_subdomain}'。"
+                )
+                return False
+            return True
+        except DuplicateKeyError:
+            self.logger.error(
+                f"subdomain '{new_subdomain}' 已存在於 domain '{domain}' 下。"
+            )
+            return False
+        except Exception as e:
+            self.logger.error(
+                f"更新 subdomain '{origin_subdomain}' 至 '{new_subdomain}' 失敗: {str(e)}"
+            )
+            return False
+
+    def delete_subdomain(self, subdomain_to_delete):
+        try:
+            result = self.collection.delete_one({"name": subdomain_to_delete})
+            if result.deleted_count == 0:
+                raise Exception("未找到匹配的 subdomain，刪除未執行。")
+            self.logger.info(f"subdomain '{subdomain_to_delete}' 已成功從 MongoDB 中刪除。")
+            return True
+        except Exception as e:
+            self.logger.error(f"刪除 subdomain 時發生錯誤: {str(e)}")
+            raise
+
+    def save_domains_to_mongodb(self, domain, subdomain):
+        try:
+            self.collection.update_one(
+                {"domain": domain, "name": subdomain},
+                {"$setOnInsert": {"enable": True}},
+                upsert=True,
+            )
+        except Exception as e:
+            self.logger.error("添加 domain 失敗: %s", str(e))
+            raise
+
+    def disable_subdomain(self, subdomain):
+        try:
+            result = self.collection.update_one(
+                {"name": subdomain}, {"$set": {"enable": False}}
+            )
+            if result.modified_count == 0:
+                raise Exception("未找到指定的 subdomain 或已 disable")
+            return True
+        except Exception as e:
+            self.logger.error("disable subdomain 失敗: %s", str(e))
+            raise
+
+    def enable_subdomain(self, subdomain):
+        try:
+            result = self.collection.update_one(
+                {"name": subdomain}, {"$set": {"enable": True}}
+            )
+            if result.modified_count == 0:
+                raise Exception("未找到指定的 subdomain 或已 enable")
+            return True
+        except Exception as e:
+            self.logger.error("enable subdomain 失敗: %s", str(e))
+            raise
+
+
+class CachedDomainRepo:
+    """
+    包在 DomainRepo / SubdomainRepo 外層的 read-through LRU 快取。
+
+    讀取結果直接回傳快取中的物件，呼叫端不可修改；寫入一律經過這一層，
+    由各寫入方法精準清除受影響的 domain、subdomain 與整份清單。
+    """
+
+    ALL_KEY = ("all",)
+
+    def __init__(self, repo, max_size=10000):
+        self.repo = repo
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # 每次清除都遞增，查詢期間有寫入時不回填舊資料
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.logger = logging.getLogger(__name__)
+
+    def __getattr__(self, name):
+        return getattr(self.repo, name)
+
+    def _read(self, key, load):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            generation = self.generation
+        value = load()
+        with self.lock:
+            if generation == self.generation:
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return value
+
+    def _domains_containing(self, subdomains):
+        # 只知道 subdomain 時，從快取中找出包含它的 domain
+        domains = set()
+        for key, value in self.entries.items():
+            if key[0] == "subdomain" and key[1] in subdomains and value:
+                domains.add(value["domain"])
+            elif key[0] == "domain" and value:
+                if any(item["name"] in subdomains for item in value["subdomains"]):
+                    domains.add(key[1])
+        return domains
+
+    def invalidate(self, domains=(), subdomains=()):
+        subdomains = set(subdomains)
+        with self.lock:
+            domains = set(domains) | self._domains_containing(subdomains)
+            keys = [("domain", domain) for domain in domains]
+            keys += [("subdomain", subdomain) for subdomain in subdomains]
+            keys.append(self.ALL_KEY)
+            for key in keys:
+                if self.entries.pop(key, None) is not None:
+                    self.invalidations += 1
+            self.generation += 1
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0,
+                "invalidations": self.invalidations,
+            }
+
+    def get_domain_from_mongodb(self, domain):
+        return self._read(
+            ("domain", domain), lambda: self.repo.get_domain_from_mongodb(domain)
+        )
+
+    def get_subdomain_data_from_mongodb(self, subdomain):
+        return self._read(
+            ("subdomain", subdomain),
+            lambda: self.repo.get_subdomain_data_from_mongodb(subdomain),
+        )
+
+    def get_all_domains_from_mongodb(self):
+        # 讀取失敗時 repo 會丟出例外，不會留下快取
+        return self._read(self.ALL_KEY, self.repo.get_all_domains_from_mongodb)
+
+    def iter_domains_from_mongodb(self, batch_size=500):
+        with self.lock:
+            domains = self.entries.get(self.ALL_KEY)
+            if domains is not None:
+                self.entries.move_to_end(self.ALL_KEY)
+                self.hits += 1
+        if domains is not None:
+            return iter(domains)
+        # 串流讀取不回填，避免一次把整個 collection 留在記憶體
+        return self.repo.iter_domains_from_mongodb(batch_size)
+
+    def add_subdomain_to_mongodb(self, domain, subdomain):
+        try:
+            return self.repo.add_subdomain_to_mongodb(domain, subdomain)
+        finally:
+            self.invalidate([domain], [subdomain])
+
+    def bulk_add_subdomains_to_mongodb(self, subdomains_by_domain):
+        try:
+            return self.repo.bulk_add_subdomains_to_mongodb(subdomains_by_domain)
+        finally:
+            self.invalidate(
+                subdomains_by_domain,
+                [s for subdomains in subdomains_by_domain.values() for s in subdomains],
+            )
+
+    def apply_subdomain_changes(self, changes):
+        try:
+            return self.repo.apply_subdomain_changes(changes)
+        finally:
+            self.invalidate(
+                changes,
+                [
+                    subdomain
+                    for change in changes.values()
+                    for subdomains in change.values()
+                    for subdomain in subdomains
+                ],
+            )
+
+    def write_domain_data_to_mongodb(self, domain_data):
+        try:
+            return self.repo.write_domain_data_to_mongodb(domain_data)
+        finally:
+            self.clear()
+
+    def update_subdomain_in_mongodb(self, domain, origin_subdomain, new_subdomain):
+        try:
+            return self.repo.update_subdomain_in_mongodb(
+                domain, origin_subdomain, new_subdomain
+            )
+        finally:
+            self.invalidate([domain], [origin_subdomain, new_subdomain])
+
+    def delete_subdomain(self, subdomain_to_delete):
+        try:
+            return self.repo.delete_subdomain(subdomain_to_delete)
+        finally:
+            self.invalidate(subdomains=[subdomain_to_delete])
+
+    def save_domains_to_mongodb(self, domain, subdomain):
+        try:
+            return self.repo.save_domains_to_mongodb(domain, subdomain)
+        finally:
+            self.invalidate([domain], [subdomain])
+
+    def disable_subdomain(self, subdomain):
+        try:
+            return self.repo.disable_subdomain(subdomain)
+        finally:
+            self.invalidate(subdomains=[subdomain])
+
+    def enable_subdomain(self, subdomain):
+        try:
+            return self.repo.enable_subdomain(subdomain)
+        finally:
+            self.invalidate(subdomains=[subdomain])
+
+
+class ZoneCacheRepo:
+    """快取 Cloudflare zone 的 modified_on 與 DNS 紀錄清單，供增量同步比對。"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.logger = logging.getLogger(__name__)
+
+    def get_zones(self):
+        return {item["_id"]: item for item in self.collection.find({})}
+
+    def save_zones(self, zones):
+        operations = [
+            ReplaceOne({"_id": zone["_id"]}, zone, upsert=True) for zone in zones
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+    def delete_zones(self, zone_ids):
+        if zone_ids:
+            self.collection.delete_many({"_id": {"$in": list(zone_ids)}})
+
+
+class AlertStateRepo:
+    """記錄每個 subdomain 最後一次送出告警時的區間與時間，用來判斷是否需要再通知。"""
+
+    CHUNK_SIZE = 1000
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.logger = logging.getLogger(__name__)
+
+    def get_states(self, subdomains):
+        states = {}
+        subdomains = list(subdomains)
+        for start in range(0, len(subdomains), self.CHUNK_SIZE):
+            chunk = subdomains[start : start + self.CHUNK_SIZE]
+            for item in self.collection.find({"_id": {"$in": chunk}}):
+                states[item["_id"]] = item
+        return states
+
+    def mark_sent(self, states, sent_at):
+        operations = [
+            UpdateOne(
+                {"_id": subdomain},
+                {
+                    "$set": {
+                        "bucket": bucket,
+                        "expire_at": expire_at,
+                        "last_sent_at": sent_at,
+                    }
+                },
+                upsert=True,
+            )
+            for subdomain, (bucket, expire_at) in states.items()
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+    def clear(self, subdomains):
+        subdomains = list(subdomains)
+        for start in range(0, len(subdomains), self.CHUNK_SIZE):
+            chunk = subdomains[start : start + self.CHUNK_SIZE]
+            self.collection.delete_many({"_id": {"$in": chunk}})
+
+
+OUTBOX_PENDING = "pending"
+OUTBOX_SENDING = "sending"
+OUTBOX_SENT = "sent"
+OUTBOX_FAILED = "failed"
+
+OUTBOX_INDEXES = [
+    IndexModel(
+        [("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next"
+    ),
+    # 已送出的通知保留一段時間供查詢與去重，之後由 TTL 索引自動刪除
+    IndexModel([("sent_at", ASCENDING)], name="sent_ttl", expireAfterSeconds=7 * 86400),
+]
+
+
+class OutboxRepo:
+    """待送通知的 outbox，_id 即 idempotency key，重複寫入同一則通知不會重送。"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.logger = logging.getLogger(__name__)
+
+    def ensure_indexes(self):
+        return create_indexes(self.collection, OUTBOX_INDEXES, self.logger)
+
+    def enqueue(self, messages, now):
+        """messages 為 [(idempotency_key, chat_id, text, priority)]，回傳新寫入的筆數。"""
+        operations = [
+            UpdateOne(
+                {"_id": key},
+                {
+                    "$setOnInsert": {
+                        "chat_id": chat_id,
+                        "text": text,
+                        "priority": priority,
+                        "status": OUTBOX_PENDING,
+                        "attempts": 0,
+                        "created_at": now,
+                        "next_attempt_at": now,
+                    }
+                },
+                upsert=True,
+            )
+            for key, chat_id, text, priority in messages
+        ]
+        if not operations:
+            return 0
+        return self.collection.bulk_write(operations, ordered=False).upserted_count
+
+    def claim(self, now, lease_seconds):
+        # 領取一則到期的通知；送出中的 next_attempt_at 即租約到期時間，
+        # 租約過期（例如 pod 重啟）的通知會被重新領取
+        return self.collection.find_one_and_update(
+            {
+                "status": {"$in": [OUTBOX_PENDING, OUTBOX_SENDING]},
+                "next_attempt_at": {"$lte": now},
+            },
+            {
+                "$set": {
+                    "status": OUTBOX_SENDING,
+                    "next_attempt_at": now + lease_seconds,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("priority", ASCENDING), ("next_attempt_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def mark_sent(self, key, now):
+        self.collection.update_one(
+            {"_id": key}, {"$set": {"status": OUTBOX_SENT, "sent_at": now}}
+        )
+
+    def mark_retry(self, key, next_attempt_at, error):
+        self.collection.update_one(
+            {"_id": key},
+            {
+                "$set": {
+                    "status": OUTBOX_PENDING,
+                    "next_attempt_at": next_attempt_at,
+                    "last_error": error,
+                }
+            },
+        )
+
+    def mark_failed(self, key, error):
+        self.collection.update_one(
+            {"_id": key}, {"$set": {"status": OUTBOX_FAILED, "last_error": error}}
+        )
+
+
+def migrate_to_subdomain_collection(source, target, batch_size=500):
+    """
+    把內嵌 subdomains 陣列的文件串流搬到一個 subdomain 一份文件的 collection。
+
+    以 (domain, name) upsert 並覆寫 enable，並刪除來源中已不存在的 subdomain 與 domain，
+    可在 bot 運作中重複執行來追上最新狀態。回傳 (搬移筆數, 刪除筆數)。
+    """
+    SubdomainRepo(target).ensure_indexes()
+    migrated = 0
+    removed = 0
+    domains = set()
+    operations = []
+
+    def flush():
+        nonlocal migrated, removed, operations
+        if not operations:
+            return
+        result = target.bulk_write(operations, ordered=False)
+        migrated += sum(1 for operation in operations if isinstance(operation, UpdateOne))
+        removed += result.deleted_count
+        operations = []
+
+    results = source.find(
+        {"domain": {"$type": "string"}}, DOMAIN_PROJECTION, batch_size=batch_size
+    )
+    for item in results:
+        domains.add(item["domain"])
+        names = []
+        for subdomain_dict in item.get("subdomains", []):
+            names.append(subdomain_dict["name"])
+            operations.append(
+                UpdateOne(
+                    {"domain": item["domain"], "name": subdomain_dict["name"]},
+                    {"$set": {"enable": subdomain_dict.get("enable") == True}},
+                    upsert=True,
+                )
+            )
+        # 上次搬移後在來源被刪除或改名的 subdomain，不能留在新 collection 繼續被監控
+        operations.append(
+            DeleteMany({"domain": item["domain"], "name": {"$nin": names}})
+        )
+        if len(operations) >= batch_size:
+            flush()
+            logger.info(f"已搬移 {migrated} 筆 subdomain。")
+    flush()
+    # 整個 domain 都已從來源刪除的情況
+    removed += target.delete_many({"domain": {"$nin": list(domains)}}).deleted_count
+    logger.info(f"搬移完成，共 {migrated} 筆 subdomain，刪除 {removed} 筆已不存在的 subdomain。")
+    return migrated, removed
@@ -1,10 +1,69 @@
-from utils.cert import get_ssl_cert_info
+import time
+from utils.prober import (
+    get_ssl_cert_probes,
+    probe_ssl_cert,
+    get_ssl_cert_fanouts,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_TIMEOUT,
+    DEFAULT_FANOUT_MAX_ADDRESSES,
+)
+from utils.cert_cache import CertCache, DEFAULT_MAX_SIZE, DEFAULT_TTL
+from utils.check_pipeline import (
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_DEDUPE_SIZE,
+)
+from utils.expiry import DEFAULT_THRESHOLDS_DAYS
+from classes.fleet import FleetSnapshot
+from classes.suffix_index import SuffixIndex
 
 
 class DomainService:
-    def __init__(self, repo, cloudflare_manager):
+    def __init__(
+        self,
+        repo,
+        cloudflare_manager,
+        probe_config=None,
+        alert_config=None,
+        zone_cache=None,
+        alert_state=None,
+        outbox=None,
+    ):
         self.repo = repo
         self.cloudflare_manager = cloudflare_manager
+        self.zone_cache = zone_cache
+        self.alert_state = alert_state
+        self.outbox = outbox
+        probe_config = probe_config or {}
+        self.probe_concurrency = probe_config.get(
+            "probe_concurrency", DEFAULT_CONCURRENCY
+        )
+        self.probe_timeout = probe_config.get("probe_timeout", DEFAULT_TIMEOUT)
+        self.probe_per_ip = probe_config.get("probe_per_ip", False)
+        self.fanout_max_addresses = probe_config.get(
+            "fanout_max_addresses", DEFAULT_FANOUT_MAX_ADDRESSES
+        )
+        self.pipeline_queue_size = probe_config.get(
+            "pipeline_queue_size", DEFAULT_QUEUE_SIZE
+        )
+        self.pipeline_dedupe_size = probe_config.get(
+            "pipeline_dedupe_size", DEFAULT_DEDUPE_SIZE
+        )
+        self.mongo_batch_size = probe_config.get("mongo_batch_size", DEFAULT_BATCH_SIZE)
+        # 互動指令優先使用最近一次巡檢或查詢的結果，同一個 host 同時只握手一次
+        self.cert_cache = CertCache(
+            probe_config.get("cert_cache_ttl", DEFAULT_TTL),
+            probe_config.get("cert_cache_size", DEFAULT_MAX_SIZE),
+        )
+        alert_config = alert_config or {}
+        self.alert_thresholds_days = alert_config.get(
+            "alert_thresholds_days", DEFAULT_THRESHOLDS_DAYS
+        )
+        self.alert_cooldown_seconds = (
+            alert_config.get("alert_cooldown_hours", 24) * 3600
+        )
+        self.fleet = FleetSnapshot()
+        self.suffix_index = SuffixIndex()
 
     def get_domain_info(self, domain):
         get_result = self.repo.get_domain_from_mongodb(domain)
@@ -31,70 +90,358 @@ class DomainService:
         else:
             raise Exception(f"Domains not found")
 
-    def add_subdomain(self, domain, subdomain):
-        if get_ssl_cert_info(subdomain, check_only=True):
-            return self.repo.add_subdomain_to_mongodb(domain, subdomain)
-        else:
-            raise ValueError("證書檢查失敗, 請檢查輸入的 subdomain 是否正確。")
+    def iter_domain_documents(self, batch_size):
+        return self.repo.iter_domains_from_mongodb(batch_size)
 
-    def bulk_add_subdomains(self, domain, subdomains):
-        failed_subdomains = []
-        for subdomain in subdomains:
-            if not get_ssl_cert_info(domain, check_only=True):
-                failed_subdomains.append(subdomain)
-                continue
-            self.repo.add_subdomain_to_mongodb(domain, subdomain)
-        if failed_subdomains:
+    def refresh_fleet(self):
+        # 空清單代表目前沒有要監控的 subdomain，不視為錯誤
+        domains = self.repo.get_all_domains_from_mongodb()
+        self.fleet.load(domains)
+        self.suffix_index.load(domains)
+        return self.fleet
+
+    def find_subdomains(self, pattern, limit=None):
+        """依 hostname pattern 查詢，例如 *.staging.example.com 或 example.com，回傳 (前 limit 筆, 總筆數)。"""
+        if not self.suffix_index.loaded:
+            self.refresh_fleet()
+        return self.suffix_index.search(pattern, limit)
+
+    def get_enabled_entries(self):
+        return self.refresh_fleet().enabled_entries()
+
+    def get_enabled_subdomains(self):
+        # 同一個 subdomain 可能掛在多個 domain 下，只回傳一次
+        return list(
+            dict.fromkeys(subdomain for _, subdomain in self.get_enabled_entries())
+        )
+
+    def get_inventory_version(self):
+        # 使用常駐清單時回傳其版本號，排程可依此判斷清單是否有變動
+        inventory = getattr(self.repo, "inventory", None)
+        return inventory.version if inventory is not None else None
+
+    def get_cache_stats(self):
+        stats = {"cert_cache": self.cert_cache.stats()}
+        if hasattr(self.repo, "stats"):
+            stats["repo_cache"] = self.repo.stats()
+        return stats
+
+    def get_fleet_report(self):
+        report = []
+        for domain, records in self.refresh_fleet().domains().items():
+            report.append(
+                {"domain": domain, "subdomains": [record.host for record in records]}
+            )
+        if not report:
+            raise Exception(f"Domains not found")
+        return report
+
+    def record_probe_outcomes(self, outcomes):
+        for subdomain, outcome in outcomes.items():
+            self.fleet.record_probe(
+                subdomain,
+                outcome["expire_at"],
+                outcome["fingerprint"],
+                outcome["status"],
+            )
+
+    def select_due_alerts(self, alerts, now=None):
+        # 區間或證書改變時立即通知，否則要超過冷卻時間才再送一次
+        if self.alert_state is None:
+            return alerts
+        now = time.time() if now is None else now
+        states = self.alert_state.get_states({alert[0] for alert in alerts})
+        due = []
+        for alert in alerts:
+            subdomain, _, expire_at, _, bucket = alert
+            state = states.get(subdomain)
+            if (
+                state is None
+                or state["bucket"] != bucket
+                or state.get("expire_at") != float(expire_at)
+                or now - state["last_sent_at"] >= self.alert_cooldown_seconds
+            ):
+                due.append(alert)
+        return due
+
+    def record_sent_alerts(self, alerts, now=None):
+        if self.alert_state is None:
+            return
+        now = time.time() if now is None else now
+        self.alert_state.mark_sent(
+            {
+                subdomain: (bucket, float(expire_at))
+                for subdomain, _, expire_at, _, bucket in alerts
+            },
+            now,
+        )
+
+    def clear_alert_states(self, subdomains):
+        if self.alert_state is not None:
+            self.alert_state.clear(subdomains)
+
+    def verify_subdomain_cert(self, subdomain):
+        # 一次握手同時取得證書內容與驗證結果，之後不需要再握手
+        result = self.probe_cert(subdomain)
+        if not result["verified"]:
+            reason = result["verify_error"] or result["error"]
             raise ValueError(
-                f"以下 subdomain 證書檢查失敗,請檢查輸入是否正確：{', '.join(failed_subdomains)}"
+                f"證書檢查失敗, 請檢查輸入的 subdomain 是否正確。({reason})"
             )
+        return result
+
+    def add_subdomain(self, domain, subdomain):
+        self.verify_subdomain_cert(subdomain)
+        result = self.repo.add_subdomain_to_mongodb(domain, subdomain)
+        self.suffix_index.add(subdomain, domain)
+        return result
+
+    def validate_subdomains(self, subdomains, progress=None):
+        # 以有上限的並行握手一次驗證所有候選 subdomain
+        accepted = []
+        rejected = {}
+        on_result = None
+        if progress is not None:
+            progress.set_stage("驗證證書", len(set(subdomains)))
+
+            def on_result(subdomain, result):
+                progress.advance(failed=not result["verified"])
+
+        results = self.cert_cache.get_many(subdomains)
+        if on_result is not None:
+            for subdomain, result in results.items():
+                on_result(subdomain, result)
+        missing = [subdomain for subdomain in subdomains if subdomain not in results]
+        if missing:
+            results.update(self.get_cert_probes(missing, on_result))
+        for subdomain, result in results.items():
+            if result["verified"]:
+                accepted.append(subdomain)
+            else:
+                rejected[subdomain] = result["verify_error"] or result["error"]
+        return accepted, rejected
+
+    def import_subdomains(self, subdomains_by_domain, progress=None):
+        """驗證後把通過的 subdomain 一次寫入，回傳 {"accepted": {domain: [...]}, "rejected": {subdomain: 原因}}。"""
+        accepted, rejected = self.validate_subdomains(
+            [
+                subdomain
+                for subdomains in subdomains_by_domain.values()
+                for subdomain in subdomains
+            ],
+            progress,
+        )
+        accepted = set(accepted)
+        accepted_by_domain = {}
+        for domain, subdomains in subdomains_by_domain.items():
+            valid = [
+                subdomain for subdomain in dict.fromkeys(subdomains) if subdomain in accepted
+            ]
+            if valid:
+                accepted_by_domain[domain] = valid
+        self.repo.bulk_add_subdomains_to_mongodb(accepted_by_domain)
+        for domain, subdomains in accepted_by_domain.items():
+            for subdomain in subdomains:
+                self.suffix_index.add(subdomain, domain)
+        return {"accepted": accepted_by_domain, "rejected": rejected}
+
+    def bulk_add_subdomains(self, domain, subdomains):
+        return self.import_subdomains({domain: subdomains})
 
     def update_subdomain(self, domain, origin_subdomain, new_subdomain):
-        if get_ssl_cert_info(new_subdomain, check_only=True):
-            result = self.repo.update_subdomain_in_mongodb(
-                domain, origin_subdomain, new_subdomain
-            )
-            if not result:
-                raise Exception("更新失敗，請檢查輸入的資料。")
-            return result
-        else:
-            raise ValueError("證書檢查失敗, 請檢查輸入的 subdomain 是否正確。")
+        self.verify_subdomain_cert(new_subdomain)
+        result = self.repo.update_subdomain_in_mongodb(
+            domain, origin_subdomain, new_subdomain
+        )
+        if not result:
+            raise Exception("更新失敗，請檢查輸入的資料。")
+        removed = self.suffix_index.remove(origin_subdomain, domain)
+        self.suffix_index.add(new_subdomain, domain, removed.get(domain, True))
+        return result
 
     def delete_subdomain(self, subdomain_to_delete):
         result = self.repo.delete_subdomain(subdomain_to_delete)
         if not result:
             raise Exception("未找到匹配的 subdomain，刪除未執行。")
+        # 同一個 subdomain 掛在多個 domain 下的少見情況，下次 refresh_fleet 會再校正
+        self.suffix_index.remove(subdomain_to_delete)
         return result
 
+    def probe_cert(self, host):
+        # 一次探測最多兩次握手（驗證失敗時改用不驗證的連線重試），等待上限再多留一點 DNS 的時間
+        return self.cert_cache.get_or_probe(
+            host,
+            lambda host: probe_ssl_cert(host, self.probe_timeout),
+            self.probe_timeout * 2 + 1,
+        )
+
     def get_cert_info(self, domain):
-        cert = get_ssl_cert_info(domain, check_only=False)
-        if cert is None or cert is False:
-            raise ValueError(f"Domain {domain} 證書檢查失敗,請檢查輸入是否正確。")
-        return cert
+        result = self.probe_cert(domain)
+        if result["cert"] is None:
+            raise Exception(f"Domain {domain} 證書檢查失敗,請檢查輸入是否正確。")
+        return result
 
-    def process_domains(self):
-        domains = self.cloudflare_manager.fetch_all_domains_and_records()
+    def get_cert_probes(self, subdomains, on_result=None):
+        # 一律重新握手，結果同時更新快取給之後的互動查詢使用
+        results = get_ssl_cert_probes(
+            subdomains, self.probe_concurrency, self.probe_timeout, on_result
+        )
+        self.cert_cache.put_many(results)
+        return results
+
+    def get_cert_fanouts(self, subdomains):
+        return get_ssl_cert_fanouts(
+            subdomains,
+            self.probe_concurrency,
+            self.probe_timeout,
+            self.fanout_max_addresses,
+        )
+
+    def process_domains(self, progress=None):
+        # 邊讀取 Cloudflare 分頁邊彙整，不需要先等整份清單
+        domains = self.cloudflare_manager.iter_domains_and_records()
+        if progress is not None:
+            progress.set_stage("讀取 Cloudflare 紀錄")
+            domains = progress.track(domains)
         domain_dict = self.cloudflare_manager.convert_domains_to_dict(domains)
-        failed_domains = []
-        valid_domains = []
+        return self.import_subdomains(domain_dict, progress)
 
-        for domain, subdomains in domain_dict.items():
-            for subdomain in subdomains:
-                if not get_ssl_cert_info(subdomain, check_only=True):
-                    failed_domains.append(subdomain)
-                    continue
-                self.repo.save_domains_to_mongodb(domain, subdomain)
-            valid_domains.append(domain)
+    def diff_zone(self, zone, previous, current):
+        """
+        previous 為上次同步快取的紀錄，None 代表這個 zone 第一次同步。
 
-        if failed_domains:
-            raise ValueError(
-                f"以下 Subdomain 證書檢查失敗,請檢查輸入是否正確：{', '.join(failed_domains)}"
+        之後的同步只移除上次還在 Cloudflare、這次已不在的紀錄，手動加入的 subdomain 不受影響；
+        第一次同步沒有可比對的紀錄，MongoDB 中這個 zone 底下 Cloudflare 已沒有的名稱全部移除。
+        """
+        present = {record["name"] for record in zone["records"]}
+        monitored = [
+            record["name"]
+            for record in zone["records"]
+            if self.cloudflare_manager.is_monitored(zone["name"], record)
+        ]
+        monitored_names = set(monitored)
+        first_sync = previous is None
+        previous = previous or []
+        previous_names = {record["name"] for record in previous}
+        # 上次同步時不在監控範圍（例如開了 proxy）而被停用的紀錄；手動 /disable 的不會出現在這裡
+        previously_unmonitored = previous_names - {
+            record["name"]
+            for record in previous
+            if self.cloudflare_manager.is_monitored(zone["name"], record)
+        }
+        return {
+            "add": [name for name in dict.fromkeys(monitored) if name not in current],
+            "enable": [
+                name
+                for name, enabled in current.items()
+                if not enabled
+                and name in monitored_names
+                and name in previously_unmonitored
+            ],
+            "disable": [
+                name
+                for name, enabled in current.items()
+                if enabled and name in present and name not in monitored_names
+            ],
+            "remove": [
+                name
+                for name in current
+                if (first_sync or name in previous_names) and name not in present
+            ],
+        }
+
+    def sync_cloudflare(self, full=False, progress=None):
+        """
+        增量同步 Cloudflare：只重新讀取 modified_on 有變動的 zone，
+        與 MongoDB 比對後一次寫入新增、重新啟用、停用與移除。
+        """
+        if self.zone_cache is None:
+            raise Exception("未設定 Cloudflare zone 快取，無法同步")
+        cached = self.zone_cache.get_zones()
+        if progress is not None:
+            progress.set_stage("讀取 Cloudflare zone")
+        zones = list(self.cloudflare_manager.iter_zones())
+        changed = [
+            zone
+            for zone in zones
+            if full
+            or zone["id"] not in cached
+            or cached[zone["id"]].get("modified_on") != zone.get("modified_on")
+        ]
+        listings = self.cloudflare_manager.fetch_zone_listings(changed)
+        if progress is not None:
+            progress.set_stage("讀取 Cloudflare 紀錄", len(changed))
+            listings = progress.track(listings)
+        fresh = [
+            {
+                "_id": zone["id"],
+                "name": zone["name"],
+                "modified_on": zone.get("modified_on"),
+                "records": records,
+            }
+            for zone, records in listings
+        ]
+        # 已從 Cloudflare 刪除的 zone 視為沒有任何紀錄
+        removed_zone_ids = cached.keys() - {zone["id"] for zone in zones}
+        synced_zones = fresh + [
+            dict(cached[zone_id], records=[]) for zone_id in removed_zone_ids
+        ]
+
+        domains = {zone["name"] for zone in synced_zones}
+        existing = {
+            domain_data["domain"]: {
+                item["name"]: item.get("enable") == True
+                for item in domain_data["subdomains"]
+            }
+            for domain_data in self.repo.iter_domains_from_mongodb(self.mongo_batch_size)
+            if domain_data["domain"] in domains
+        }
+        changes = {}
+        for zone in synced_zones:
+            previous = cached[zone["_id"]]["records"] if zone["_id"] in cached else None
+            changes[zone["name"]] = self.diff_zone(
+                zone, previous, existing.get(zone["name"], {})
             )
 
-        return valid_domains
+        # 新增的 subdomain 仍需通過證書驗證
+        accepted, rejected = self.validate_subdomains(
+            [name for change in changes.values() for name in change["add"]], progress
+        )
+        accepted = set(accepted)
+        for change in changes.values():
+            change["add"] = [name for name in change["add"] if name in accepted]
+        changes = {domain: change for domain, change in changes.items() if any(change.values())}
+
+        self.repo.apply_subdomain_changes(changes)
+        for domain, change in changes.items():
+            for name in change.get("add", []):
+                self.suffix_index.add(name, domain)
+            for name in change.get("enable", []):
+                self.suffix_index.set_enable(name, True, domain)
+            for name in change.get("disable", []):
+                self.suffix_index.set_enable(name, False, domain)
+            for name in change.get("remove", []):
+                self.suffix_index.remove(name, domain)
+        # 有紀錄沒通過驗證的 zone 不記 modified_on，下次同步會重新讀取並再驗證一次
+        for zone in fresh:
+            if any(record["name"] in rejected for record in zone["records"]):
+                zone["modified_on"] = None
+        # MongoDB 寫入成功後才更新快取，失敗時下次同步會重試
+        self.zone_cache.save_zones(fresh)
+        self.zone_cache.delete_zones(removed_zone_ids)
+        return {
+            "zones_fetched": len(fresh),
+            "zones_unchanged": len(zones) - len(changed),
+            "changes": changes,
+            "rejected": rejected,
+        }
 
     def disable_subdomain(self, subdomain):
-        return self.repo.disable_subdomain(subdomain)
+        result = self.repo.disable_subdomain(subdomain)
+        self.suffix_index.set_enable(subdomain, False)
+        return result
 
     def enable_subdomain(self, subdomain):
-        return self.repo.enable_subdomain(subdomain)
+        result = self.repo.enable_subdomain(subdomain)
+        self.suffix_index.set_enable(subdomain, True)
+        return result
@@ -0,0 +1,213 @@
+import threading
+from fnmatch import fnmatchcase
+from itertools import islice
+
+WILDCARD_CHARS = "*?["
+
+
+class _Node:
+    __slots__ = ("children", "host", "domains", "count")
+
+    def __init__(self):
+        self.children = {}
+        self.host = None
+        # {domain: enable}，同一個 hostname 可能掛在多個 domain 下
+        self.domains = None
+        # 子樹（含自己）的 (hostname, domain) 筆數，計算符合筆數時不必走訪整個子樹
+        self.count = 0
+
+
+def reversed_labels(hostname):
+    # www.staging.example.com -> ["com", "example", "staging", "www"]
+    return hostname.strip().rstrip(".").lower().split(".")[::-1]
+
+
+def _has_wildcard(label):
+    return any(char in label for char in WILDCARD_CHARS)
+
+
+class SuffixIndex:
+    """
+    以反轉 label 建立的 hostname trie，查詢成本與符合的筆數成正比。
+
+    查詢規則：
+      example.com              該 hostname 與其下所有 subdomain（整個 zone）
+      *.staging.example.com    staging.example.com 之下任意層的 subdomain，不含自己
+      api.*.example.com        中間的 * 只比對單一 label，層數必須相同
+      api-*.example.com        label 內的 * / ? 依 fnmatch 比對
+
+    除了開頭的 *. 以外，* 一律只比對單一 label：api.* 只會符合 api.com 這類單層 TLD，
+    不會符合 api.example.co.uk。
+    """
+
+    def __init__(self):
+        self.root = _Node()
+        self.size = 0
+        self.loaded = False
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return self.size
+
+    def load(self, domains_data):
+        with self.lock:
+            self.root = _Node()
+            self.size = 0
+            for domain_data in domains_data:
+                for item in domain_data.get("subdomains", []):
+                    self.add(item["name"], domain_data["domain"], item.get("enable") == True)
+            self.loaded = True
+
+    def _node(self, hostname, create=False):
+        node = self.root
+        for label in reversed_labels(hostname):
+            child = node.children.get(label)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[label] = _Node()
+            node = child
+        return node
+
+    def _path(self, hostname, create=False):
+        path = [self.root]
+        for label in reversed_labels(hostname):
+            child = path[-1].children.get(label)
+            if child is None:
+                if not create:
+                    return None
+                child = path[-1].children[label] = _Node()
+            path.append(child)
+        return path
+
+    def add(self, hostname, domain, enable=True):
+        # 與 MongoDB 的 $setOnInsert 一致，已存在的紀錄保留原本的 enable
+        with self.lock:
+            path = self._path(hostname, create=True)
+            node = path[-1]
+            if node.domains is None:
+                node.host = hostname
+                node.domains = {}
+            if domain not in node.domains:
+                node.domains[domain] = enable
+                self.size += 1
+                for parent in path:
+                    parent.count += 1
+
+    def set_enable(self, hostname, enable, domain=None):
+        with self.lock:
+            node = self._node(hostname)
+            if node is None or node.domains is None:
+                return
+            for name in node.domains:
+                if domain is None or name == domain:
+                    node.domains[name] = enable
+
+    def remove(self, hostname, domain=None):
+        """移除 hostname（指定 domain 時只移除該 domain 下的那筆），回傳被移除的 {domain: enable}。"""
+        with self.lock:
+            path = self._path(hostname)
+            if path is None:
+                return {}
+            node = path[-1]
+            if node.domains is None:
+                return {}
+            if domain is None:
+                removed, node.domains = node.domains, {}
+            else:
+                removed = {}
+                if domain in node.domains:
+                    removed[domain] = node.domains.pop(domain)
+            self.size -= len(removed)
+            for parent in path:
+                parent.count -= len(removed)
+            if not node.domains:
+                node.host = None
+                node.domains = None
+            # 往上清掉已經沒有內容的節點
+            labels = reversed_labels(hostname)
+            for depth in range(len(labels), 0, -1):
+                node = path[depth]
+                if node.children or node.domains is not None:
+                    break
+                del path[depth - 1].children[labels[depth - 1]]
+            return removed
+
+    @staticmethod
+    def _parse(pattern):
+        labels = reversed_labels(pattern)
+        descendants = labels[-1] == "*"
+        if descendants:
+            labels = labels[:-1]
+        subtree = not descendants and not any(_has_wildcard(label) for label in labels)
+        return labels, descendants, subtree
+
+    def _ends(self, node, labels, depth=0):
+        # 依 label 排序走到 pattern 最後一層符合的節點，產生順序即 hostname 的排序
+        if depth == len(labels):
+            yield node
+            return
+        label = labels[depth]
+        if _has_wildcard(label):
+            for name, child in sorted(node.children.items()):
+                if fnmatchcase(name, label):
+                    yield from self._ends(child, labels, depth + 1)
+        else:
+            child = node.children.get(label)
+            if child is not None:
+                yield from self._ends(child, labels, depth + 1)
+
+    @staticmethod
+    def _emit(node):
+        if node.domains is not None:
+            for domain in sorted(node.domains):
+                yield {"subdomain": node.host, "domain": domain, "enable": node.domains[domain]}
+
+    def _collect(self, node):
+        # 前序走訪、子節點依 label 排序，結果與依反轉 label 排序相同
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield from self._emit(node)
+            stack.extend(child for _, child in sorted(node.children.items(), reverse=True))
+
+    def _matches(self, labels, descendants, subtree):
+        for node in self._ends(self.root, labels):
+            if descendants:
+                for _, child in sorted(node.children.items()):
+                    yield from self._collect(child)
+            elif subtree:
+                yield from self._collect(node)
+            else:
+                yield from self._emit(node)
+
+    def _count(self, labels, descendants, subtree):
+        total = 0
+        for node in self._ends(self.root, labels):
+            if descendants:
+                total += node.count - (len(node.domains) if node.domains else 0)
+            elif subtree:
+                total += node.count
+            elif node.domains:
+                total += len(node.domains)
+        return total
+
+    def find(self, pattern, limit=None):
+        """回傳符合 pattern 的 [{"subdomain", "domain", "enable"}]，依 hostname 排序，取到 limit 筆就停止走訪。"""
+        labels, descendants, subtree = self._parse(pattern)
+        with self.lock:
+            # 只有 "*" 時 labels 為空，代表所有 hostname
+            if not labels and not descendants:
+                return []
+            return list(islice(self._matches(labels, descendants, subtree), limit or None))
+
+    def search(self, pattern, limit=None):
+        """回傳 (符合的前 limit 筆, 符合的總筆數)，總筆數由子樹計數得出，不必走訪所有結果。"""
+        labels, descendants, subtree = self._parse(pattern)
+        with self.lock:
+            if not labels and not descendants:
+                return [], 0
+            return (
+                self.find(pattern, limit),
+                self._count(labels, descendants, subtree),
+            )
@@ -0,0 +1,88 @@
+"""
+對本機 MongoDB 驗證 DomainInventory 的 change stream 同步與 resume token 接續。
+
+單節點 replica set 可以這樣啟動：
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017
+    mongosh --eval 'rs.initiate()'
+然後執行：
+    python inventory_harness.py --uri "mongodb://localhost:27017/inventory_test?replicaSet=rs0"
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from classes.inventory import DomainInventory
+from classes.repos import DomainRepo, SubdomainRepo, get_collection, init_mongo_client
+
+
+def wait_for(check, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return time.monotonic() - (deadline - timeout)
+        time.sleep(0.01)
+    raise TimeoutError("等待 domain 清單更新逾時")
+
+
+def new_inventory(collection, args, snapshot_path):
+    return DomainInventory(
+        collection,
+        args.layout,
+        args.mode,
+        poll_seconds=1,
+        snapshot_path=snapshot_path,
+        snapshot_seconds=0,
+    ).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="驗證 change stream 維護的 domain 清單")
+    parser.add_argument("--uri", default="mongodb://localhost:27017/inventory_test?replicaSet=rs0")
+    parser.add_argument("--collection", default="inventory_harness")
+    parser.add_argument("--layout", choices=["embedded", "flat"], default="embedded")
+    parser.add_argument("--mode", choices=["change_stream", "polling"], default="change_stream")
+    parser.add_argument("--timeout", type=float, default=10)
+    args = parser.parse_args()
+
+    collection = get_collection(init_mongo_client(args.uri), args.collection)
+    collection.drop()
+    repo = SubdomainRepo(collection) if args.layout == "flat" else DomainRepo(collection)
+    repo.ensure_indexes()
+    repo.bulk_add_subdomains_to_mongodb({"example.com": ["a.example.com", "b.example.com"]})
+    snapshot_path = os.path.join(tempfile.mkdtemp(), "inventory_snapshot.json")
+
+    inventory = new_inventory(collection, args, snapshot_path)
+    inventory.wait_ready(args.timeout)
+    print(f"初次載入: {inventory.stats()}")
+
+    # 直接寫入 MongoDB，不經過 InventoryRepo，確認變更是由 stream 帶進來的
+    repo.add_subdomain_to_mongodb("example.com", "c.example.com")
+    elapsed = wait_for(lambda: inventory.get_subdomain("c.example.com"), args.timeout)
+    print(f"新增 subdomain 後 {elapsed * 1000:.0f} ms 反映到清單")
+    repo.disable_subdomain("a.example.com")
+    elapsed = wait_for(
+        lambda: inventory.get_subdomain("a.example.com")["enable"] is False, args.timeout
+    )
+    print(f"停用 subdomain 後 {elapsed * 1000:.0f} ms 反映到清單")
+    repo.delete_subdomain("b.example.com")
+    elapsed = wait_for(
+        lambda: inventory.get_subdomain("b.example.com") is None, args.timeout
+    )
+    print(f"刪除 subdomain 後 {elapsed * 1000:.0f} ms 反映到清單")
+    inventory.stop()
+
+    # 停止期間的寫入要在重啟後由 resume token 補上，而不是重新掃描
+    repo.add_subdomain_to_mongodb("example.org", "d.example.org")
+    inventory = new_inventory(collection, args, snapshot_path)
+    elapsed = wait_for(lambda: inventory.get_subdomain("d.example.org"), args.timeout)
+    stats = inventory.stats()
+    inventory.stop()
+    print(f"重啟後 {elapsed * 1000:.0f} ms 補上停止期間的變更: {stats}")
+    if args.mode == "change_stream" and stats["mode"] == "change_stream":
+        print("重啟後重新掃描次數:", stats["full_loads"])
+    collection.drop()
+
+
+if __name__ == "__main__":
+    main()
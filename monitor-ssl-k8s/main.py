@@ -3,15 +3,30 @@ import schedule
 import time
 import threading
 from utils.bot_commands_handler import setup_handlers
-from classes.repos import DomainRepo, init_mongo_client, get_collection
+from classes.repos import (
+    AlertStateRepo,
+    CachedDomainRepo,
+    DomainRepo,
+    OutboxRepo,
+    SubdomainRepo,
+    ZoneCacheRepo,
+    init_mongo_client,
+    get_collection,
+)
+from classes.inventory import DomainInventory, InventoryRepo
 from classes.services import DomainService
 from utils.config_loader import EnvConfigLoader, YamlConfigLoader
 from utils.scheduler_jobs import setup_scheduler
 from utils.cloudflare import CloudflareManager
+from utils.cert import telegram_gateway, telegram_notifier
+from utils.outbox import OutboxWorker
+from utils.jobs import JobManager
+from utils.telegram_gateway import GatewayBot, PRIORITY_REPORT
+from utils.webhook import WebhookServer
 
 
-def setup_bot_handlers(bot, service):
-    setup_handlers(bot, service)
+def setup_bot_handlers(bot, service, job_manager=None):
+    setup_handlers(bot, service, job_manager)
 
 
 def run_schedule():
@@ -30,11 +45,17 @@ if __name__ == "__main__":
     # mongodb_config = EnvConfigLoader.get_mongodb_config()
     # telegram_config = EnvConfigLoader.get_telegram_config()
     # cloudflare_config = EnvConfigLoader.get_cloudflare_config()
+    # probe_config = EnvConfigLoader.get_probe_config()
+    # scheduler_config = EnvConfigLoader.get_scheduler_config()
+    # alert_config = EnvConfigLoader.get_alert_config()
 
     yaml_loader = YamlConfigLoader("config.yaml")
     mongodb_config = yaml_loader.get_mongodb_config()
     telegram_config = yaml_loader.get_telegram_config()
     cloudflare_config = yaml_loader.get_cloudflare_config()
+    probe_config = yaml_loader.get_probe_config()
+    scheduler_config = yaml_loader.get_scheduler_config()
+    alert_config = yaml_loader.get_alert_config()
 
     mongodb_uri = mongodb_config["mongodb_uri"]
     telegram_bot_token = telegram_config["telegram_bot_token"]
@@ -42,22 +63,96 @@ if __name__ == "__main__":
     cloudflare_email = cloudflare_config["cloudflare_email"]
     cloudflare_api_key = cloudflare_config["cloudflare_api_key"]
 
-    bot = telebot.TeleBot(telegram_bot_token)
+    # 所有送出的訊息都經過 gateway 排隊與限流
+    webhook_mode = telegram_config["bot_mode"] == "webhook"
+    # webhook 模式由 WebhookServer 的 worker pool 執行 handler，不再經過 telebot 的 thread pool
+    bot = GatewayBot(
+        telebot.TeleBot(telegram_bot_token, threaded=not webhook_mode),
+        telegram_gateway,
+    )
 
     client = init_mongo_client(mongodb_uri)
-    collection_name = "cert"
-    collection = get_collection(client, collection_name)
+    if mongodb_config["storage_layout"] == "flat":
+        collection = get_collection(client, mongodb_config["subdomain_collection"])
+        domain_repo = SubdomainRepo(collection)
+    else:
+        collection = get_collection(client, mongodb_config["collection_name"])
+        domain_repo = DomainRepo(collection)
+    # 唯一索引建立失敗代表已有重複資料，直接中止啟動
+    domain_repo.ensure_indexes()
+    if mongodb_config["repo_cache_size"] > 0:
+        domain_repo = CachedDomainRepo(domain_repo, mongodb_config["repo_cache_size"])
+    if mongodb_config["inventory_mode"] != "off":
+        # 排程與查詢指令都讀記憶體中的清單，不再每次掃描 collection
+        inventory = DomainInventory(
+            collection,
+            mongodb_config["storage_layout"],
+            mongodb_config["inventory_mode"],
+            mongodb_config["inventory_poll_seconds"],
+            mongodb_config["inventory_snapshot_path"],
+            mongodb_config["inventory_snapshot_seconds"],
+        ).start()
+        # 清單載入完成前的讀取會落到下層的快取，寫入也經過快取清除受影響的項目
+        domain_repo = InventoryRepo(domain_repo, inventory)
+    zone_cache = ZoneCacheRepo(
+        get_collection(client, mongodb_config["zone_cache_collection"])
+    )
+    alert_state = AlertStateRepo(
+        get_collection(client, mongodb_config["alert_state_collection"])
+    )
+    outbox = OutboxRepo(get_collection(client, mongodb_config["outbox_collection"]))
+    outbox.ensure_indexes()
 
-    cloudflare_manager = CloudflareManager(cloudflare_api_key, cloudflare_email)
+    cloudflare_manager = CloudflareManager(
+        cloudflare_api_key,
+        cloudflare_email,
+        cloudflare_config["cloudflare_api_url"],
+        cloudflare_config["cloudflare_max_workers"],
+        cloudflare_config["cloudflare_rate_limit"],
+    )
 
-    domain_repo = DomainRepo(collection)
-    domain_service = DomainService(domain_repo, cloudflare_manager)
+    domain_service = DomainService(
+        domain_repo,
+        cloudflare_manager,
+        probe_config,
+        alert_config,
+        zone_cache,
+        alert_state,
+        outbox,
+    )
 
-    setup_bot_handlers(bot, domain_service)
-    setup_scheduler(
+    job_manager = JobManager(
         bot,
+        scheduler_config["job_workers"],
+        scheduler_config["job_progress_interval_seconds"],
+    )
+    setup_bot_handlers(bot, domain_service, job_manager)
+    setup_scheduler(
+        bot.with_priority(PRIORITY_REPORT),
         domain_service,
         telegram_group_id,
+        scheduler_config,
     )
+    # 通知由背景 worker 從 outbox 送出，重啟後會接續未送完的通知
+    OutboxWorker(
+        outbox,
+        telegram_notifier,
+        alert_config["outbox_poll_seconds"],
+        max_attempts=alert_config["outbox_max_attempts"],
+    ).start()
     run_in_background(run_schedule)
-    bot.infinity_polling()
+    if webhook_mode:
+        webhook_server = WebhookServer(
+            bot,
+            telegram_config["webhook_host"],
+            telegram_config["webhook_port"],
+            telegram_config["webhook_path"],
+            telegram_config["webhook_secret"],
+            telegram_config["webhook_workers"],
+            telegram_config["webhook_queue_size"],
+        )
+        if telegram_config["webhook_url"]:
+            webhook_server.register(telegram_config["webhook_url"])
+        webhook_server.serve_forever()
+    else:
+        bot.infinity_polling()
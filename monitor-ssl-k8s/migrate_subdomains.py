@@ -0,0 +1,32 @@
+import argparse
+from classes.repos import (
+    init_mongo_client,
+    get_collection,
+    migrate_to_subdomain_collection,
+)
+from utils.config_loader import YamlConfigLoader
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="把 subdomains 內嵌陣列搬到一個 subdomain 一份文件的 collection"
+    )
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    mongodb_config = YamlConfigLoader(args.config).get_mongodb_config()
+    client = init_mongo_client(mongodb_config["mongodb_uri"])
+    if client is None:
+        return
+    source = get_collection(client, mongodb_config["collection_name"])
+    target = get_collection(client, mongodb_config["subdomain_collection"])
+    migrated, removed = migrate_to_subdomain_collection(
+        source, target, args.batch_size
+    )
+    print(f"已搬移 {migrated} 筆 subdomain 至 {target.name}，刪除 {removed} 筆已不存在的 subdomain。")
+    print("確認資料無誤後，將 config.yaml 的 storage_layout 改為 flat 並重新啟動。")
+
+
+if __name__ == "__main__":
+    main()
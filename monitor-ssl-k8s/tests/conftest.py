@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# utils.cert 在 import 時會以相對路徑讀取 config.yaml
+os.chdir(ROOT)
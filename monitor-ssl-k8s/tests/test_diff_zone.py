@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+
+import pytest
+
+from classes.services import DomainService
+from utils.cloudflare import CloudflareManager
+
+
+def record(name, proxied=False, type="A"):
+    return {"name": name, "type": type, "proxied": proxied}
+
+
+@pytest.fixture
+def service():
+    # diff_zone 只用到 cloudflare_manager.is_monitored，不需要 MongoDB 與 Cloudflare 連線
+    return SimpleNamespace(cloudflare_manager=CloudflareManager("key", "email"))
+
+
+def diff(service, records, previous, current):
+    zone = {"name": "example.com", "records": records}
+    return DomainService.diff_zone(service, zone, previous, current)
+
+
+def test_adds_monitored_records_not_in_mongo(service):
+    change = diff(
+        service,
+        [
+            record("a.example.com"),
+            record("b.example.com", proxied=True),
+            record("_acme.example.com", type="CNAME"),
+            record("example.com"),
+            record("mail.example.com", type="MX"),
+        ],
+        [],
+        {},
+    )
+    assert change["add"] == ["a.example.com"]
+
+
+def test_existing_records_are_not_added_again(service):
+    change = diff(service, [record("a.example.com")], [], {"a.example.com": True})
+    assert change["add"] == []
+
+
+def test_disables_records_that_became_proxied(service):
+    change = diff(
+        service,
+        [record("a.example.com", proxied=True)],
+        [record("a.example.com")],
+        {"a.example.com": True},
+    )
+    assert change["disable"] == ["a.example.com"]
+    assert change["enable"] == []
+
+
+def test_reenables_records_that_are_no_longer_proxied(service):
+    change = diff(
+        service,
+        [record("a.example.com")],
+        [record("a.example.com", proxied=True)],
+        {"a.example.com": False},
+    )
+    assert change["enable"] == ["a.example.com"]
+
+
+def test_keeps_manually_disabled_records_disabled(service):
+    # 上次同步時就在監控範圍內，停用是使用者手動 /disable 的
+    change = diff(
+        service,
+        [record("a.example.com")],
+        [record("a.example.com")],
+        {"a.example.com": False},
+    )
+    assert change["enable"] == []
+    assert change["disable"] == []
+
+
+def test_removes_only_records_seen_in_the_previous_sync(service):
+    change = diff(
+        service,
+        [],
+        [record("gone.example.com")],
+        {"gone.example.com": True, "manual.example.com": True},
+    )
+    assert change["remove"] == ["gone.example.com"]
+
+
+def test_first_sync_prunes_every_name_cloudflare_no_longer_has(service):
+    change = diff(
+        service,
+        [record("a.example.com")],
+        None,
+        {"a.example.com": True, "stale.example.com": True},
+    )
+    assert change["remove"] == ["stale.example.com"]
+    assert change["add"] == []
@@ -0,0 +1,63 @@
+import pytest
+
+from utils.expiry import DAY, EXPIRED, bucket_labels, classify_expiries, group_by_bucket
+from utils.expiry_scheduler import ExpiryScheduler
+
+NOW = 1_700_000_000
+THRESHOLDS = (1, 7, 14, 30)
+
+
+def test_bucket_labels_are_sorted_after_expired():
+    assert bucket_labels((30, 1, 7)) == [EXPIRED, "1d", "7d", "30d"]
+
+
+def test_classify_expiries_assigns_the_smallest_matching_threshold():
+    expires = [NOW - 1, NOW + 0.5 * DAY, NOW + 7 * DAY, NOW + 10 * DAY, NOW + 45 * DAY]
+    bucket_index, remaining_days = classify_expiries(expires, THRESHOLDS, NOW)
+    assert list(bucket_index) == [0, 1, 2, 3, -1]
+    assert list(remaining_days) == [-1, 0, 7, 10, 45]
+
+
+def test_group_by_bucket_only_returns_alerting_buckets():
+    names = ["expired", "soon", "later", "fine"]
+    expires = [NOW - DAY, NOW + 3 * DAY, NOW + 20 * DAY, NOW + 90 * DAY]
+    buckets = group_by_bucket(names, expires, THRESHOLDS, NOW)
+    assert {label: [item[0] for item in items] for label, items in buckets.items()} == {
+        EXPIRED: ["expired"],
+        "7d": ["soon"],
+        "30d": ["later"],
+    }
+    assert buckets["7d"][0] == ("soon", NOW + 3 * DAY, 3)
+
+
+def test_group_by_bucket_handles_an_empty_round():
+    assert group_by_bucket([], [], THRESHOLDS, NOW) == {}
+
+
+@pytest.fixture
+def scheduler():
+    return ExpiryScheduler(THRESHOLDS, max_interval=7 * DAY, alert_interval=DAY)
+
+
+def test_interval_shrinks_with_each_threshold_bucket(scheduler):
+    intervals = [
+        scheduler.next_interval(days * DAY, 0, 0) for days in (25, 12, 5, 0.9)
+    ]
+    assert intervals == sorted(intervals, reverse=True)
+    assert intervals[0] == DAY
+
+
+def test_interval_outside_the_window_waits_until_the_largest_threshold(scheduler):
+    assert scheduler.next_interval(33 * DAY, 0, 0) == 3 * DAY
+    assert scheduler.next_interval(90 * DAY, 0, 0) == 7 * DAY
+
+
+def test_interval_checks_again_when_entering_the_next_bucket(scheduler):
+    # 剩 14.2 天，0.2 天後進入 14 天區間時就要再檢查
+    assert scheduler.next_interval(14.2 * DAY, 0, 0) == pytest.approx(0.2 * DAY)
+
+
+def test_failures_back_off_but_stay_below_the_alert_interval(scheduler):
+    assert scheduler.next_interval(None, 1, 0) == 300
+    assert scheduler.next_interval(None, 2, 0) == 600
+    assert scheduler.next_interval(None, 20, 0) == DAY
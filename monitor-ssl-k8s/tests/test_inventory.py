@@ -0,0 +1,110 @@
+import pytest
+
+from classes.inventory import DomainInventory
+
+
+def change(operation, key=None, document=None):
+    change = {"operationType": operation}
+    if key is not None:
+        change["documentKey"] = {"_id": key}
+    if document is not None:
+        change["fullDocument"] = document
+    return change
+
+
+@pytest.fixture
+def inventory():
+    # apply_change 只更新記憶體內的清單，不會碰到 collection
+    return DomainInventory(None)
+
+
+def test_insert_keeps_only_the_projected_fields(inventory):
+    document = {
+        "_id": 1,
+        "domain": "example.com",
+        "subdomains": [{"name": "www.example.com", "enable": True}],
+        "updated_at": 123,
+    }
+    assert inventory.apply_change(change("insert", 1, document))
+    assert inventory.documents[1] == {
+        "_id": 1,
+        "domain": "example.com",
+        "subdomains": [{"name": "www.example.com", "enable": True}],
+    }
+    assert inventory.get_subdomain("www.example.com") == {
+        "subdomain": "www.example.com",
+        "domain": "example.com",
+        "enable": True,
+    }
+
+
+def test_update_and_delete_refresh_the_views(inventory):
+    inventory.apply_change(
+        change("insert", 1, {"_id": 1, "domain": "example.com", "subdomains": []})
+    )
+    version = inventory.version
+    assert inventory.get_domain("example.com")["subdomains"] == []
+
+    inventory.apply_change(
+        change(
+            "update",
+            1,
+            {
+                "_id": 1,
+                "domain": "example.com",
+                "subdomains": [{"name": "api.example.com", "enable": False}],
+            },
+        )
+    )
+    assert inventory.version > version
+    assert inventory.get_domain("example.com")["subdomains"] == [
+        {"name": "api.example.com", "enable": False}
+    ]
+
+    assert inventory.apply_change(change("delete", 1))
+    assert inventory.get_domain("example.com") is None
+    assert inventory.events == 3
+
+
+def test_update_without_full_document_is_ignored(inventory):
+    assert inventory.apply_change(change("update", 1))
+    assert inventory.documents == {}
+    assert inventory.events == 0
+
+
+@pytest.mark.parametrize(
+    "operation", ["drop", "rename", "dropDatabase", "invalidate"]
+)
+def test_stream_ending_events_return_false(inventory, operation):
+    assert not inventory.apply_change(change(operation))
+
+
+def test_flat_layout_groups_documents_by_domain():
+    inventory = DomainInventory(None, layout="flat")
+    for key, name in enumerate(["www.example.com", "api.example.com"]):
+        inventory.apply_change(
+            change(
+                "insert",
+                key,
+                {
+                    "_id": key,
+                    "domain": "example.com",
+                    "name": name,
+                    "enable": True,
+                    "subdomains": "ignored",
+                },
+            )
+        )
+    assert "subdomains" not in inventory.documents[0]
+    assert inventory.get_all_domains() == [
+        {
+            "domain": "example.com",
+            "subdomains": [
+                {"name": "api.example.com", "enable": True},
+                {"name": "www.example.com", "enable": True},
+            ],
+        }
+    ]
+    assert inventory.domains_of(["api.example.com", "missing.example.com"]) == [
+        "example.com"
+    ]
@@ -0,0 +1,60 @@
+from utils.outbox import alert_window, enqueue_messages, idempotency_key
+
+HOUR = 3600
+ALERTS = [
+    ("a.example.com", "example.com", 1_700_000_000, 5, "7d"),
+    ("b.example.com", "example.com", 1_700_100_000, 6, "7d"),
+]
+
+
+class FakeOutbox:
+    def __init__(self):
+        self.keys = set()
+
+    def enqueue(self, messages, now):
+        inserted = 0
+        for key, _, _, _ in messages:
+            if key not in self.keys:
+                self.keys.add(key)
+                inserted += 1
+        return inserted
+
+
+def test_alert_window_changes_once_the_cooldown_has_passed():
+    cooldown = 6 * HOUR
+    assert alert_window(cooldown, 0) == alert_window(cooldown, cooldown - 1)
+    for start in (0, 100, cooldown - 1, 5 * cooldown + 17):
+        assert alert_window(cooldown, start) != alert_window(cooldown, start + cooldown)
+
+
+def test_alert_window_without_cooldown_is_per_run():
+    assert alert_window(0, 10) != alert_window(0, 11)
+
+
+def test_key_ignores_alert_order_and_remaining_days():
+    reordered = [
+        (subdomain, domain, expire_at, remaining_days + 1, bucket)
+        for subdomain, domain, expire_at, remaining_days, bucket in reversed(ALERTS)
+    ]
+    assert idempotency_key(1, ALERTS, 7, "text") == idempotency_key(
+        1, reordered, 7, "text"
+    )
+
+
+def test_key_changes_with_window_bucket_expiry_and_chat():
+    key = idempotency_key(1, ALERTS, 7, "text")
+    assert key != idempotency_key(1, ALERTS, 8, "text")
+    assert key != idempotency_key(2, ALERTS, 7, "text")
+    assert key != idempotency_key(1, [ALERTS[0][:4] + ("1d",), ALERTS[1]], 7, "text")
+    assert key != idempotency_key(1, [ALERTS[0][:2] + (1_800_000_000,) + ALERTS[0][3:], ALERTS[1]], 7, "text")
+
+
+def test_enqueue_reports_only_new_messages():
+    outbox = FakeOutbox()
+    cooldown = 6 * HOUR
+    window = alert_window(cooldown, 1000)
+    assert enqueue_messages(outbox, 1, ["m1", "m2"], ALERTS, window) == 2
+    # 同一冷卻區間內重跑不會重複寫入
+    assert enqueue_messages(outbox, 1, ["m1", "m2"], ALERTS, window) == 0
+    later = alert_window(cooldown, 1000 + cooldown)
+    assert enqueue_messages(outbox, 1, ["m1", "m2"], ALERTS, later) == 2
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils import rate_limit
+from utils.rate_limit import TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def test_starts_full_and_reports_the_wait(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+
+def test_refills_over_time_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    bucket.try_acquire(2)
+    clock.now += 0.5
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    clock.now += 60
+    assert bucket.try_acquire(2) == 0
+    assert bucket.try_acquire() > 0
+
+
+def test_capacity_defaults_to_at_least_one_token(clock):
+    bucket = TokenBucket(rate=20 / 60)
+    assert bucket.capacity == 1
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(3)
+
+
+def test_pause_blocks_until_retry_after(clock):
+    bucket = TokenBucket(rate=1, capacity=5)
+    bucket.pause(10)
+    assert bucket.try_acquire() == pytest.approx(11)
+    clock.now += 11
+    assert bucket.try_acquire() == 0
+
+
+def test_refund_returns_tokens_without_exceeding_capacity(clock):
+    bucket = TokenBucket(rate=1, capacity=1)
+    bucket.try_acquire()
+    bucket.refund()
+    assert bucket.try_acquire() == 0
+    bucket.refund(5)
+    assert bucket.tokens == 1
@@ -0,0 +1,98 @@
+import pytest
+
+from classes.suffix_index import SuffixIndex
+
+HOSTS = [
+    ("example.com", "example.com"),
+    ("www.example.com", "example.com"),
+    ("api.staging.example.com", "example.com"),
+    ("web.staging.example.com", "example.com"),
+    ("staging.example.com", "example.com"),
+    ("api-v1.example.com", "example.com"),
+    ("api-v2.example.com", "example.com"),
+    ("api.example.co.uk", "example.co.uk"),
+    ("api.com", "api.com"),
+]
+
+
+def names(results):
+    return [item["subdomain"] for item in results]
+
+
+@pytest.fixture
+def index():
+    index = SuffixIndex()
+    index.load(
+        [
+            {"domain": domain, "subdomains": [{"name": host, "enable": True}]}
+            for host, domain in HOSTS
+        ]
+    )
+    return index
+
+
+def test_plain_pattern_returns_the_whole_subtree_in_hostname_order(index):
+    assert names(index.find("staging.example.com")) == [
+        "staging.example.com",
+        "api.staging.example.com",
+        "web.staging.example.com",
+    ]
+
+
+def test_leading_wildcard_excludes_the_parent_itself(index):
+    assert names(index.find("*.staging.example.com")) == [
+        "api.staging.example.com",
+        "web.staging.example.com",
+    ]
+
+
+def test_middle_wildcard_matches_a_single_label(index):
+    assert names(index.find("api.*.example.com")) == ["api.staging.example.com"]
+
+
+def test_label_wildcards_use_fnmatch(index):
+    assert names(index.find("api-v?.example.com")) == [
+        "api-v1.example.com",
+        "api-v2.example.com",
+    ]
+
+
+def test_trailing_wildcard_only_matches_single_label_tlds(index):
+    assert names(index.find("api.*")) == ["api.com"]
+
+
+def test_bare_wildcard_matches_every_hostname(index):
+    matches, total = index.search("*", 3)
+    assert names(matches) == ["api.com", "example.com", "api-v1.example.com"]
+    assert total == len(HOSTS)
+
+
+def test_limit_keeps_the_first_matches_in_order(index):
+    full = index.find("example.com")
+    assert index.find("example.com", 3) == full[:3]
+
+
+def test_search_counts_all_matches_beyond_the_limit(index):
+    matches, total = index.search("example.com", 2)
+    assert len(matches) == 2
+    assert total == 7
+    assert index.search("*.staging.example.com", 1)[1] == 2
+    assert index.search("api-*.example.com", 1)[1] == 2
+
+
+def test_counts_follow_removals(index):
+    index.remove("api.staging.example.com")
+    assert index.search("example.com")[1] == 6
+    assert names(index.find("*.staging.example.com")) == ["web.staging.example.com"]
+    index.remove("staging.example.com")
+    assert index.search("staging.example.com")[1] == 1
+    assert len(index) == len(HOSTS) - 2
+
+
+def test_same_host_under_several_domains(index):
+    index.add("www.example.com", "other.com", enable=False)
+    assert [
+        (item["domain"], item["enable"]) for item in index.find("www.example.com")
+    ] == [("example.com", True), ("other.com", False)]
+    assert index.remove("www.example.com", "other.com") == {"other.com": False}
+    assert index.search("www.example.com")[1] == 1
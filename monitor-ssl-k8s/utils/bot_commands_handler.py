@@ -1,9 +1,18 @@
 import time
-from utils.cert import parse_ssl_cert_info, check_ssl_expiration
+from utils.cert import format_cert_probe
+from utils.jobs import JobManager
+from utils.notifier import split_message
+from utils.scheduler_jobs import run_ssl_checks
 from utils.utils import convert_to_yaml
 
+# /find 最多列出的筆數，其餘只顯示剩餘筆數
+FIND_LIMIT = 50
+
+
+def setup_handlers(bot, service, job_manager=None):
+    # 耗時的指令交給背景工作執行，handler thread 立即返回
+    job_manager = job_manager or JobManager(bot)
 
-def setup_handlers(bot, service):
     @bot.message_handler(commands=["get_domain"])
     def handle_get_command(message):
         try:
@@ -37,13 +46,7 @@ def setup_handlers(bot, service):
     @bot.message_handler(commands=["get_all"])
     def handle_get_all_command(message):
         try:
-            domains_data = service.get_all_domains()
-            for domain_data in domains_data:
-                for env in domain_data.get("envs", {}):
-                    domain_data["envs"][env] = [
-                        {k: v for k, v in domain.items() if k != "enable"}
-                        for domain in domain_data["envs"][env]
-                    ]
+            for domain_data in service.get_fleet_report():
                 yaml_domain_data = convert_to_yaml(domain_data)
                 bot.send_message(
                     message.chat.id, f"{yaml_domain_data}", parse_mode="Markdown"
@@ -79,10 +82,11 @@ def setup_handlers(bot, service):
                 )
             domain = parts[1]
             subdomains = parts[2:]
-            service.bulk_add_subdomains(domain, subdomains)
-            bot.reply_to(message, f"domain {domain} 下的 subdomain 批量新增成功。")
-        except ValueError as e:
-            bot.reply_to(message, str(e))
+            report = service.bulk_add_subdomains(domain, subdomains)
+            bot.reply_to(
+                message,
+                f"domain {domain} 下的 subdomain 批量新增完成。\n{convert_to_yaml(report)}",
+            )
         except Exception as e:
             bot.reply_to(
                 message, f"domain 批量新增失敗，請檢查輸入的資料。錯誤訊息：{str(e)}"
@@ -124,9 +128,8 @@ def setup_handlers(bot, service):
     def send_cert_info(message):
         try:
             _, get_domain = message.text.split(maxsplit=1)
-            cert_info = service.get_cert_info(get_domain)
-            parse_cert_info = parse_ssl_cert_info(get_domain, cert_info)
-            bot.send_message(message.chat.id, parse_cert_info)
+            cert_probe = service.get_cert_info(get_domain)
+            bot.send_message(message.chat.id, format_cert_probe(get_domain, cert_probe))
         except ValueError as e:
             bot.send_message(
                 message.chat.id, "請提供一個 domain。例如：/cert_info example.com"
@@ -140,32 +143,46 @@ def setup_handlers(bot, service):
     @bot.message_handler(commands=["check"])
     def handle_check_command(message):
         try:
-            domains_data = service.get_all_domains()
-            for domain_data in domains_data:
-                subdomains_list = domain_data["subdomains"]
-                for subdomain_dict in subdomains_list:
-                    subdomain = subdomain_dict["name"]
-                    subdomain_status = subdomain_dict["enable"]
-                    if subdomain_status == True:
-                        cert_info = service.get_cert_info(subdomain)
-                        # 假設有函數 check_ssl_expiration 來檢查 SSL 證書的到期時間
-                        check_ssl_expiration(subdomain, cert_info)
-            # 通知用戶所有檢查都已完成
-            bot.reply_to(message, "所有 domain 的 SSL 到期時間檢查完成。", parse_mode="Markdown")
+            job_manager.submit(
+                "check",
+                "/check",
+                lambda progress: run_ssl_checks(service, progress),
+                message,
+            )
         except Exception as e:
             bot.reply_to(message, str(e))  # 處理錯誤，並回報給用戶
 
 
     @bot.message_handler(commands=["add_cloudflare"])
     def handle_add_command(message):
+        def import_cloudflare(progress):
+            report = service.process_domains(progress)
+            return f"Cloudflare 匯入完成。\n{convert_to_yaml(report)}"
+
         try:
-            valid_domain = service.process_domains()
-            bot.reply_to(message, f"{convert_to_yaml(valid_domain)} 新增成功")
+            job_manager.submit(
+                "add_cloudflare", "/add_cloudflare", import_cloudflare, message
+            )
         except Exception as e:
             bot.reply_to(
                 message, f"domain 新增失敗，請檢查輸入的資料。錯誤訊息：{str(e)}"
             )
 
+    @bot.message_handler(commands=["sync_cloudflare"])
+    def handle_sync_cloudflare_command(message):
+        full = message.text.split()[1:] == ["full"]
+
+        def sync_cloudflare(progress):
+            report = service.sync_cloudflare(full, progress)
+            return f"Cloudflare 同步完成。\n{convert_to_yaml(report)}"
+
+        try:
+            job_manager.submit(
+                "sync_cloudflare", "/sync_cloudflare", sync_cloudflare, message
+            )
+        except Exception as e:
+            bot.reply_to(message, f"Cloudflare 同步失敗。錯誤訊息：{str(e)}")
+
     @bot.message_handler(commands=["disable"])
     def handle_disable_command(message):
         try:
@@ -198,6 +215,37 @@ def setup_handlers(bot, service):
                 message, f"domain 啟用失敗，請檢查輸入的資料。錯誤訊息：{str(e)}"
             )
 
+    @bot.message_handler(commands=["find"])
+    def handle_find_command(message):
+        try:
+            _, pattern = message.text.split(maxsplit=1)
+            matches, total = service.find_subdomains(pattern, FIND_LIMIT)
+            if not matches:
+                return bot.reply_to(message, f"沒有符合 {pattern} 的 subdomain。")
+            lines = [f"符合 {pattern} 的 subdomain 共 {total} 筆："]
+            for item in matches:
+                status = "" if item["enable"] else "  (停用)"
+                lines.append(f"{item['subdomain']}  [{item['domain']}]{status}")
+            if total > len(matches):
+                lines.append(f"還有 {total - len(matches)} 筆，請縮小查詢範圍。")
+            for chunk in split_message("\n".join(lines)):
+                bot.send_message(message.chat.id, chunk)
+        except ValueError:
+            bot.reply_to(
+                message,
+                "使用方式不正確。請按照以下格式輸入：\n/find <pattern>，例如 /find *.staging.example.com",
+            )
+        except Exception as e:
+            bot.reply_to(message, str(e))
+
+    @bot.message_handler(commands=["stats"])
+    def handle_stats_command(message):
+        try:
+            stats = convert_to_yaml(service.get_cache_stats())
+            bot.reply_to(message, f"快取統計：\n{stats}")
+        except Exception as e:
+            bot.reply_to(message, str(e))
+
     @bot.message_handler(commands=["help"])
     def send_help_message(message):
         help_text = """
@@ -212,6 +260,9 @@ def setup_handlers(bot, service):
 /update <domain> <old_subdomain> <new_subdomain> - 更新指定 domain 下的 subdomain 資訊。
 /del <subdomain> - 從 MongoDB 刪除指定的 subdomain。
 /check - 檢查所有 domain 的 SSL 到期時間並通知。
+/sync_cloudflare [full] - 增量同步 Cloudflare DNS 紀錄，full 會重新讀取所有 zone。
+/find <pattern> - 依 hostname 查詢 subdomain，例如 example.com、*.staging.example.com、api-*.example.com；開頭以外的 * 只比對單一 label，最多列出 50 筆。
+/stats - 顯示 domain 查詢與證書快取的命中統計。
 
 請根據需要使用上述命令。
 """
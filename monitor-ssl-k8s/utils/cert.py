@@ -1,29 +1,316 @@
 import ssl
+import time
+import hashlib
 import socket
-import requests
+import asyncio
+import threading
+from collections import OrderedDict
 from datetime import datetime
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric import dsa, ec, ed448, ed25519, rsa
+from cryptography.x509.oid import NameOID
 from utils.config_loader import YamlConfigLoader
+from utils.notifier import TelegramNotifier
+from utils.telegram_gateway import TelegramGateway
+
+try:
+    import dns.resolver
+except ImportError:
+    # 未安裝 dnspython 時改用系統 getaddrinfo，並以設定的預設 TTL 快取
+    dns = None
 
 yaml_loader = YamlConfigLoader("config.yaml")
 telegram_config = yaml_loader.get_telegram_config()
 telegram_bot_token = telegram_config["telegram_bot_token"]
 telegram_group_id = telegram_config["telegram_group_id"]
+probe_config = yaml_loader.get_probe_config()
+# bot 回覆與告警通知共用同一個 gateway，一起計算 Telegram 的限流額度
+telegram_gateway = TelegramGateway(
+    telegram_config["telegram_global_rate"],
+    telegram_config["telegram_chat_rate"],
+    telegram_config["telegram_group_rate_per_minute"],
+    telegram_config["telegram_send_workers"],
+    telegram_config["telegram_call_timeout_seconds"],
+)
+telegram_notifier = TelegramNotifier(
+    telegram_bot_token, telegram_group_id, telegram_gateway
+)
+
+_ssl_contexts = {}
+_ssl_contexts_lock = threading.Lock()
+
+
+def get_ssl_context(verify=True, check_hostname=True):
+    # 每次 create_default_context 都會重新載入系統 CA，整個 process 共用同一份
+    key = (verify, check_hostname and verify)
+    with _ssl_contexts_lock:
+        ssl_context = _ssl_contexts.get(key)
+        if ssl_context is None:
+            ssl_context = ssl.create_default_context()
+            ssl_context.check_hostname = key[1]
+            if not verify:
+                ssl_context.verify_mode = ssl.CERT_NONE
+            _ssl_contexts[key] = ssl_context
+        return ssl_context
+
+
+class DNSCache:
+    def __init__(self, default_ttl=300, negative_ttl=30, max_size=100000):
+        self.default_ttl = default_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, host, port):
+        # 回傳 (是否命中, addrinfos)；查詢失敗也會被快取為 None
+        with self.lock:
+            entry = self.entries.get((host, port))
+            if entry is None:
+                return False, None
+            expires_at, addrinfos = entry
+            if expires_at <= time.monotonic():
+                del self.entries[(host, port)]
+                return False, None
+            self.entries.move_to_end((host, port))
+            return True, addrinfos
+
+    def put(self, host, port, addrinfos, ttl=None):
+        if ttl is None:
+            ttl = self.default_ttl if addrinfos else self.negative_ttl
+        with self.lock:
+            self.entries[(host, port)] = (time.monotonic() + ttl, addrinfos)
+            self.entries.move_to_end((host, port))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
 
+dns_cache = DNSCache(probe_config["dns_cache_ttl"], probe_config["dns_negative_ttl"])
 
-def get_ssl_cert_info(domain, check_only=False):
-    ssl_context = ssl.create_default_context()
-    with ssl_context.wrap_socket(
-        socket.socket(socket.AF_INET), server_hostname=domain
-    ) as conn:
-        conn.settimeout(3.0)
+
+def _lookup_with_dnspython(host, port):
+    addrinfos = []
+    ttls = []
+    for rdtype, family in (("AAAA", socket.AF_INET6), ("A", socket.AF_INET)):
         try:
-            conn.connect((domain, 443))
-            if check_only:
-                return True
-            else:
-                return conn.getpeercert()
-        except Exception as e:
-            return False if check_only else None
+            answer = dns.resolver.resolve(host, rdtype)
+        except (dns.resolver.NoAnswer, dns.resolver.NXDOMAIN):
+            continue
+        ttls.append(answer.rrset.ttl)
+        for record in answer:
+            sockaddr = (
+                (record.address, port, 0, 0)
+                if family == socket.AF_INET6
+                else (record.address, port)
+            )
+            addrinfos.append(
+                (family, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", sockaddr)
+            )
+    return addrinfos, min(ttls) if ttls else None
+
+
+def lookup_host(host, port=443):
+    if dns is not None:
+        try:
+            addrinfos, ttl = _lookup_with_dnspython(host, port)
+            if addrinfos:
+                return addrinfos, ttl
+        except Exception:
+            pass
+    try:
+        addrinfos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        return [], None
+    return addrinfos, None
+
+
+def resolve_host(host, port=443):
+    hit, addrinfos = dns_cache.get(host, port)
+    if not hit:
+        addrinfos, ttl = lookup_host(host, port)
+        dns_cache.put(host, port, addrinfos, ttl)
+    if not addrinfos:
+        raise socket.gaierror(f"無法解析 {host}")
+    return addrinfos
+
+
+async def resolve_host_async(host, port=443):
+    hit, addrinfos = dns_cache.get(host, port)
+    if not hit:
+        loop = asyncio.get_running_loop()
+        addrinfos, ttl = await loop.run_in_executor(None, lookup_host, host, port)
+        dns_cache.put(host, port, addrinfos, ttl)
+    if not addrinfos:
+        raise socket.gaierror(f"無法解析 {host}")
+    return addrinfos
+
+
+async def prefetch_hosts(hosts, port=443, concurrency=50):
+    # 在一輪檢查開始前批次解析，讓握手迴圈只會命中快取
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def prefetch(host):
+        async with semaphore:
+            try:
+                await resolve_host_async(host, port)
+            except OSError:
+                pass
+
+    await asyncio.gather(*(prefetch(host) for host in set(hosts)))
+
+
+def _interleave_families(addrinfos):
+    # RFC 8305：IPv6 / IPv4 位址交錯嘗試
+    by_family = OrderedDict()
+    for addrinfo in addrinfos:
+        by_family.setdefault(addrinfo[0], []).append(addrinfo)
+    queues = list(by_family.values())
+    interleaved = []
+    while any(queues):
+        for queue in queues:
+            if queue:
+                interleaved.append(queue.pop(0))
+    return interleaved
+
+
+async def _connect_addrinfo(loop, addrinfo):
+    family, type_, proto, _, sockaddr = addrinfo
+    sock = socket.socket(family, type_, proto)
+    try:
+        sock.setblocking(False)
+        await loop.sock_connect(sock, sockaddr)
+        return sock
+    except BaseException:
+        sock.close()
+        raise
+
+
+def _close_if_connected(task):
+    if not task.cancelled() and task.exception() is None:
+        task.result().close()
+
+
+async def connect_happy_eyeballs(addrinfos, delay=None):
+    """依序錯開 delay 秒發起連線，第一個成功的 socket 勝出，其餘取消。"""
+    if delay is None:
+        delay = probe_config["happy_eyeballs_delay"]
+    loop = asyncio.get_running_loop()
+    remaining = _interleave_families(addrinfos)
+    pending = set()
+    winner = None
+    last_error = None
+    try:
+        while remaining or pending:
+            if remaining:
+                pending.add(
+                    asyncio.ensure_future(_connect_addrinfo(loop, remaining.pop(0)))
+                )
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=delay if remaining else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                if task.exception() is not None:
+                    last_error = task.exception()
+                elif winner is None:
+                    winner = task.result()
+                else:
+                    task.result().close()
+            if winner is not None:
+                return winner
+        raise last_error or OSError("沒有可連線的位址")
+    finally:
+        for task in pending:
+            task.cancel()
+            task.add_done_callback(_close_if_connected)
+
+
+async def open_host_socket(host, port=443):
+    addrinfos = await resolve_host_async(host, port)
+    return await connect_happy_eyeballs(addrinfos)
+
+
+_NAME_ATTRIBUTES = {
+    NameOID.COMMON_NAME: "commonName",
+    NameOID.ORGANIZATION_NAME: "organizationName",
+    NameOID.ORGANIZATIONAL_UNIT_NAME: "organizationalUnitName",
+    NameOID.COUNTRY_NAME: "countryName",
+    NameOID.STATE_OR_PROVINCE_NAME: "stateOrProvinceName",
+    NameOID.LOCALITY_NAME: "localityName",
+}
+
+
+def _name_to_tuples(name):
+    return tuple(
+        ((_NAME_ATTRIBUTES.get(attr.oid, attr.oid.dotted_string), attr.value),)
+        for attr in name
+    )
+
+
+def _format_cert_time(value):
+    # 與 getpeercert() 相同的格式，例如 'Mar  4 06:35:50 2024 GMT'
+    return f"{value:%b} {value.day:>2} {value:%H:%M:%S %Y} GMT"
+
+
+def _describe_public_key(public_key):
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return f"RSA-{public_key.key_size}"
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return f"EC-{public_key.curve.name}"
+    if isinstance(public_key, dsa.DSAPublicKey):
+        return f"DSA-{public_key.key_size}"
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return "Ed25519"
+    if isinstance(public_key, ed448.Ed448PublicKey):
+        return "Ed448"
+    return type(public_key).__name__
+
+
+def describe_der_cert(der):
+    """解析 DER 證書，回傳結構化欄位及與 getpeercert() 相容的 dict。"""
+    cert = x509.load_der_x509_certificate(der)
+    try:
+        san = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+        subject_alt_names = san.value.get_values_for_type(x509.DNSName)
+    except x509.ExtensionNotFound:
+        subject_alt_names = []
+    not_before = _format_cert_time(cert.not_valid_before_utc)
+    not_after = _format_cert_time(cert.not_valid_after_utc)
+    return {
+        "cert": {
+            "subject": _name_to_tuples(cert.subject),
+            "issuer": _name_to_tuples(cert.issuer),
+            "version": cert.version.value + 1,
+            "serialNumber": format(cert.serial_number, "X"),
+            "notBefore": not_before,
+            "notAfter": not_after,
+            "subjectAltName": tuple(("DNS", name) for name in subject_alt_names),
+        },
+        "not_before": not_before,
+        "not_after": not_after,
+        "not_after_ts": cert.not_valid_after_utc.timestamp(),
+        "subject_alt_names": subject_alt_names,
+        "issuer": cert.issuer.rfc4514_string(),
+        "key_type": _describe_public_key(cert.public_key()),
+        "fingerprint": hashlib.sha256(der).hexdigest(),
+    }
+
+
+def format_cert_probe(domain, result):
+    if result["cert"] is None:
+        return f"domain錯誤: 無法取得 {domain} 的 SSL 證書資訊。{result['error'] or ''}"
+    lines = [
+        parse_ssl_cert_info(domain, result["cert"]),
+        f"SANs: {', '.join(result['subject_alt_names'])}",
+        f"Key Type: {result['key_type']}",
+        f"SHA-256: {result['fingerprint']}",
+        f"Chain Length: {len(result['chain'])}" if result["chain"] else None,
+        "Verified: yes"
+        if result["verified"]
+        else f"Verified: no ({result['verify_error']})",
+    ]
+    return "\n".join(line for line in lines if line is not None)
 
 
 def parse_ssl_cert_info(domain, cert):
@@ -49,67 +336,3 @@ def parse_ssl_cert_info(domain, cert):
         f"Valid Until: {valid_until}"
     )
     return cert_info
-
-
-def check_ssl_cert_valid(domain):
-    ssl_context = ssl.create_default_context()
-    conn = ssl_context.wrap_socket(
-        socket.socket(socket.AF_INET), server_hostname=domain
-    )
-    conn.settimeout(3.0)
-    try:
-        conn.connect((domain, 443))
-        return True
-    except Exception as e:
-        print(f"無法取得 {domain} 的 SSL，錯誤：{e}")
-        return False
-    finally:
-        conn.close()
-
-
-def get_ssl_cert_expiry_date(cert):
-    if cert is None:
-        return None
-    try:
-        expire_date = datetime.strptime(cert["notAfter"], "%b %d %H:%M:%S %Y %Z")
-        return expire_date
-    except Exception as e:
-        print(f"Error parsing SSL certificate's expiry date: {e}")
-        return None
-
-
-def check_ssl_expiration(subdomain, cert_info):
-    expire_date = get_ssl_cert_expiry_date(cert_info)
-    if expire_date:
-        remaining_days = (expire_date - datetime.utcnow()).days
-        if remaining_days <= 30:
-            message = "\n".join(
-                [
-                    "來源: Cloudflare",
-                    "標題: 憑證將到期",
-                    f"domain : {subdomain}",
-                    f"到期日: {expire_date.strftime('%Y-%m-%d')}",
-                    f"剩餘天數: {remaining_days}",
-                ]
-            )
-
-            print(f"{subdomain} 的 SSL 證書將在 {remaining_days} 天內過期。")
-            send_notification(message, subdomain)
-        else:
-            print(
-                f"{subdomain} 的 SSL 證書過期日期是 {expire_date.strftime('%Y-%m-%d')}。"
-            )
-
-
-def send_notification(message, subdomain):
-    telegram_send_message_url = (
-        f"https://api.telegram.org/bot{telegram_bot_token}/sendMessage"
-    )
-    response = requests.post(
-        telegram_send_message_url, data={"chat_id": telegram_group_id, "text": message}
-    )
-
-    if response.status_code == 200:
-        print(f"已為 {subdomain} 發送通知")
-    else:
-        print(f"為 {subdomain} 發送失敗")
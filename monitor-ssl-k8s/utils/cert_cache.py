@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_SIZE = 10000
+DEFAULT_WAIT_TIMEOUT = 10
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CertCache:
+    """
+    行程內共用的探測結果快取，以 TTL 與 LRU 上限控制大小。
+
+    同一個 host 同時只會有一次進行中的探測，其他請求等待並共用它的結果。
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _get_locked(self, host):
+        entry = self.entries.get(host)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at <= time.monotonic():
+            del self.entries[host]
+            return None
+        self.entries.move_to_end(host)
+        return result
+
+    def get(self, host):
+        with self.lock:
+            result = self._get_locked(host)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def get_many(self, hosts):
+        with self.lock:
+            found = {}
+            for host in hosts:
+                result = self._get_locked(host)
+                if result is not None:
+                    found[host] = result
+            self.hits += len(found)
+            self.misses += len(set(hosts)) - len(found)
+            return found
+
+    def put(self, host, result):
+        # 連證書都沒拿到的結果不快取，下次請求會重新握手
+        if result is None or result.get("cert") is None:
+            return
+        with self.lock:
+            self.entries[host] = (time.monotonic() + self.ttl, result)
+            self.entries.move_to_end(host)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def put_many(self, results):
+        for host, result in results.items():
+            self.put(host, result)
+
+    def invalidate(self, host):
+        with self.lock:
+            self.entries.pop(host, None)
+
+    def start(self, host):
+        """登記一次探測，回傳 (flight, 是否由呼叫端負責探測)。"""
+        with self.lock:
+            flight = self.inflight.get(host)
+            if flight is not None:
+                return flight, False
+            flight = _Flight()
+            self.inflight[host] = flight
+            return flight, True
+
+    def finish(self, host, flight, result=None, error=None):
+        if error is None:
+            self.put(host, result)
+        with self.lock:
+            if self.inflight.get(host) is flight:
+                del self.inflight[host]
+        flight.result = result
+        flight.error = error
+        flight.done.set()
+
+    def get_or_probe(self, host, probe, wait_timeout=DEFAULT_WAIT_TIMEOUT):
+        result = self.get(host)
+        if result is not None:
+            return result
+        flight, leader = self.start(host)
+        if not leader:
+            with self.lock:
+                self.coalesced += 1
+            if flight.done.wait(wait_timeout):
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result
+            # 進行中的探測遲遲沒有結束，不再等待，自己探測一次
+            result = probe(host)
+            self.put(host, result)
+            return result
+        result = None
+        error = None
+        try:
+            result = probe(host)
+            return result
+        except BaseException as e:
+            # 中斷（例如取消）時也要讓等待中的呼叫端收到錯誤，而不是把例外本身轉交出去
+            error = e if isinstance(e, Exception) else Exception(f"{host} 的探測被中斷")
+            raise
+        finally:
+            self.finish(host, flight, result, error)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "inflight": len(self.inflight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,328 @@
+import asyncio
+import time
+from collections import OrderedDict
+from classes.fleet import STATUS_OK, STATUS_UNVERIFIED, STATUS_FAILED
+from utils.cert import telegram_config, telegram_notifier
+from utils.expiry import cert_expiry_timestamp, group_by_bucket
+from utils.notifier import ExpiryDigest
+from utils.outbox import alert_window, enqueue_messages
+from utils.prober import fetch_ssl_cert_fanout, inspect_ssl_cert
+
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_DEDUPE_SIZE = 10000
+
+
+def outcome_from_fanout(subdomain, fanout, issues):
+    fingerprints = [
+        endpoint["fingerprint"]
+        for endpoint in fanout["endpoints"]
+        if endpoint["fingerprint"]
+    ]
+    if fanout["divergent"]:
+        issues["divergent"][subdomain] = fanout["endpoints"]
+    if fanout["cert"] is None:
+        status = STATUS_FAILED
+    elif fanout["verify_error"]:
+        # 任一節點驗證失敗就視為未通過驗證，仍以最早到期的證書判斷到期
+        status = STATUS_UNVERIFIED
+        issues["unverified"][subdomain] = fanout["verify_error"]
+    else:
+        status = STATUS_OK
+    if fanout["cert"] is not None and fanout["unreachable"]:
+        # 部分節點連不上是網路問題，另外列出，其餘節點的證書仍照常判斷
+        issues["unreachable"][subdomain] = fanout["unreachable"]
+    # 只保留後續需要的欄位，整輪巡檢期間不必留住完整的證書內容
+    return {
+        "expire_at": cert_expiry_timestamp(cert=fanout["cert"]),
+        "fingerprint": fingerprints[0] if fingerprints else None,
+        "status": status,
+        "error": fanout["error"],
+    }
+
+
+def outcome_from_probe(subdomain, result, issues):
+    # 驗證失敗的證書仍然拿來判斷到期，過期證書才會被通知
+    if result["cert"] is None:
+        status = STATUS_FAILED
+    elif result["verified"]:
+        status = STATUS_OK
+    else:
+        status = STATUS_UNVERIFIED
+        issues["unverified"][subdomain] = result["verify_error"]
+    return {
+        "expire_at": cert_expiry_timestamp(result),
+        "fingerprint": result.get("fingerprint"),
+        "status": status,
+        "error": result["error"],
+    }
+
+
+def new_issues():
+    return {"divergent": {}, "unverified": {}, "unreachable": {}}
+
+
+def new_digest(service):
+    return ExpiryDigest(telegram_config["platform"], service.alert_thresholds_days)
+
+
+def add_expiration(digest, subdomain, domain, expire_at, remaining_days, bucket):
+    print(f"{subdomain} 的 SSL 證書將在 {remaining_days} 天內過期。")
+    digest.add(subdomain, domain, expire_at, remaining_days, bucket)
+
+
+def send_digest(service, digest, alerts):
+    # 整輪的告警合併成少數幾則摘要訊息
+    if not len(digest):
+        return False
+    if service.outbox is None:
+        return digest.send(telegram_notifier)
+    # 寫入 outbox 即視為已交付，實際送出由背景 worker 負責，不會拖慢探測
+    messages = digest.messages()
+    window = alert_window(service.alert_cooldown_seconds, time.time())
+    inserted = enqueue_messages(
+        service.outbox, telegram_notifier.chat_id, messages, alerts, window
+    )
+    if not inserted:
+        # 同一冷卻區間內已寫入過相同的告警，不再重複記錄
+        print(f"{len(digest)} 筆到期告警已在 outbox 中，略過")
+        return False
+    print(f"已將 {len(digest)} 筆到期告警寫入 outbox，共 {len(messages)} 則訊息")
+    return True
+
+
+def deliver_alerts(service, alerts, resolved=()):
+    """alerts 為 (subdomain, domain, expire_at, remaining_days, bucket)，只送出需要通知的部分。"""
+    due = service.select_due_alerts(alerts)
+    digest = new_digest(service)
+    for alert in due:
+        add_expiration(digest, *alert)
+    # 只有真的送出或寫入 outbox 時才記錄告警狀態
+    if send_digest(service, digest, due):
+        service.record_sent_alerts(due)
+    # 已不在告警區間的 subdomain 清除狀態，之後再進入告警時視為新的狀態變化
+    service.clear_alert_states(resolved)
+    return len(due)
+
+
+def _take(iterator, size):
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) >= size:
+            break
+    return batch
+
+
+class CheckPipeline:
+    """
+    MongoDB cursor → 展開 subdomain → 探測 → 分類 → 通知/寫回 的串流 pipeline。
+
+    每個階段之間都是有上限的 asyncio.Queue，下游跟不上時上游會被擋住，
+    第一批文件讀到就開始探測。告警與已恢復的 subdomain 每 batch_size 筆處理一次，
+    重複 host 的結果只保留最近 dedupe_size 筆，記憶體用量與 fleet 大小無關。
+    """
+
+    def __init__(
+        self,
+        service,
+        queue_size=DEFAULT_QUEUE_SIZE,
+        batch_size=DEFAULT_BATCH_SIZE,
+        progress=None,
+        dedupe_size=DEFAULT_DEDUPE_SIZE,
+    ):
+        self.service = service
+        self.progress = progress
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.dedupe_size = dedupe_size
+        self.workers = service.probe_concurrency
+        # 進行中的探測只在等待期間保留 Task，完成後改存精簡結果給重複出現的 host 使用；
+        # 超過上限時淘汰最久沒用到的 host，之後再出現會重新探測
+        self.inflight = {}
+        self.outcomes = OrderedDict()
+        self.failed_subdomains = {}
+        self.issues = new_issues()
+        self.alerts = []
+        self.resolved = []
+
+    async def read_documents(self, out_queue):
+        loop = asyncio.get_running_loop()
+        documents = self.service.iter_domain_documents(self.batch_size)
+        while True:
+            # pymongo 的 cursor 會阻塞，一次在 thread 中取一批
+            batch = await loop.run_in_executor(None, _take, documents, self.batch_size)
+            if not batch:
+                break
+            for document in batch:
+                await out_queue.put(document)
+        await out_queue.put(None)
+
+    async def expand_targets(self, in_queue, out_queue):
+        while True:
+            document = await in_queue.get()
+            if document is None:
+                break
+            self.service.fleet.merge(document)
+            for subdomain_dict in document.get("subdomains", []):
+                if subdomain_dict.get("enable") == True:
+                    if self.progress is not None:
+                        self.progress.add_total()
+                    await out_queue.put((document["domain"], subdomain_dict["name"]))
+        for _ in range(self.workers):
+            await out_queue.put(None)
+
+    async def probe_host(self, host):
+        timeout = self.service.probe_timeout
+        if self.service.probe_per_ip:
+            fanout = await fetch_ssl_cert_fanout(
+                host, timeout, max_addresses=self.service.fanout_max_addresses
+            )
+            return outcome_from_fanout(host, fanout, self.issues)
+        # 登記進行中的探測，讓同時查詢同一個 host 的互動指令等這次結果
+        cache = self.service.cert_cache
+        flight, leader = cache.start(host)
+        try:
+            result = await inspect_ssl_cert(host, timeout)
+        except BaseException as e:
+            if leader:
+                cache.finish(host, flight, error=e)
+            raise
+        if leader:
+            cache.finish(host, flight, result)
+        else:
+            cache.put(host, result)
+        return outcome_from_probe(host, result, self.issues)
+
+    async def probe_targets(self, in_queue, out_queue):
+        while True:
+            entry = await in_queue.get()
+            if entry is None:
+                break
+            domain, host = entry
+            # 同一輪中重複出現的 host 共用同一次探測
+            outcome = self.outcomes.get(host)
+            first_seen = False
+            if outcome is not None:
+                self.outcomes.move_to_end(host)
+            else:
+                task = self.inflight.get(host)
+                if task is None:
+                    task = asyncio.ensure_future(self.probe_host(host))
+                    self.inflight[host] = task
+                    first_seen = True
+                try:
+                    outcome = await task
+                finally:
+                    if first_seen:
+                        self.inflight.pop(host, None)
+                if first_seen:
+                    self.outcomes[host] = outcome
+                    while len(self.outcomes) > self.dedupe_size:
+                        self.outcomes.popitem(last=False)
+            await out_queue.put((domain, host, outcome, first_seen))
+
+    async def run_probe_workers(self, in_queue, out_queue):
+        await asyncio.gather(
+            *(self.probe_targets(in_queue, out_queue) for _ in range(self.workers))
+        )
+        await out_queue.put(None)
+
+    async def evaluate(self, in_queue, out_queue):
+        done = False
+        while not done:
+            batch = [await in_queue.get()]
+            # 把已經在佇列中的結果一起取出，整批做一次分類
+            while len(batch) < self.batch_size and not in_queue.empty():
+                batch.append(in_queue.get_nowait())
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            probed = [item for item in batch if item[2]["expire_at"] is not None]
+            # 以批次內的位置當名稱，分類後再對回原本的 (domain, host)
+            buckets = group_by_bucket(
+                list(range(len(probed))),
+                [item[2]["expire_at"] for item in probed],
+                self.service.alert_thresholds_days,
+            )
+            findings = {}
+            for bucket, entries in buckets.items():
+                for index, expire_at, remaining_days in entries:
+                    findings[index] = (bucket, expire_at, remaining_days)
+            for index, item in enumerate(probed):
+                await out_queue.put((item, findings.get(index)))
+            for item in batch:
+                if item[2]["expire_at"] is None:
+                    await out_queue.put((item, None))
+        await out_queue.put(None)
+
+    async def notify_and_persist(self, in_queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            evaluated = await in_queue.get()
+            if evaluated is None:
+                break
+            (domain, host, outcome, first_seen), finding = evaluated
+            if self.progress is not None:
+                self.progress.advance(failed=outcome["expire_at"] is None)
+            if first_seen:
+                self.service.fleet.record_probe(
+                    host, outcome["expire_at"], outcome["fingerprint"], outcome["status"]
+                )
+                if outcome["expire_at"] is None:
+                    # 被淘汰後重新探測的 host 可能再失敗一次，報告中只列一次
+                    self.failed_subdomains[host] = None
+                elif finding is None:
+                    self.resolved.append(host)
+            if finding is not None:
+                bucket, expire_at, remaining_days = finding
+                self.alerts.append((host, domain, expire_at, remaining_days, bucket))
+            # 告警與已恢復的 subdomain 分批處理，不必累積到整輪結束
+            if len(self.alerts) >= self.batch_size or len(self.resolved) >= self.batch_size:
+                await self.flush(loop)
+        await self.flush(loop)
+
+    async def flush(self, loop):
+        alerts, self.alerts = self.alerts, []
+        resolved, self.resolved = self.resolved, []
+        if alerts or resolved:
+            await loop.run_in_executor(
+                None, deliver_alerts, self.service, alerts, resolved
+            )
+
+    async def run(self):
+        if self.progress is not None:
+            self.progress.set_stage("探測證書")
+        documents = asyncio.Queue(self.queue_size)
+        targets = asyncio.Queue(self.queue_size)
+        results = asyncio.Queue(self.queue_size)
+        evaluated = asyncio.Queue(self.queue_size)
+        tasks = [
+            asyncio.ensure_future(coro)
+            for coro in (
+                self.read_documents(documents),
+                self.expand_targets(documents, targets),
+                self.run_probe_workers(targets, results),
+                self.evaluate(results, evaluated),
+                self.notify_and_persist(evaluated),
+            )
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # 任一階段失敗時取消其他階段，避免卡在佇列上
+            for task in tasks:
+                task.cancel()
+            raise
+        return list(self.failed_subdomains), self.issues
+
+
+def run_check_pipeline(service, progress=None):
+    pipeline = CheckPipeline(
+        service,
+        service.pipeline_queue_size,
+        service.mongo_batch_size,
+        progress,
+        service.pipeline_dedupe_size,
+    )
+    return asyncio.run(pipeline.run())
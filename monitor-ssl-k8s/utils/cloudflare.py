@@ -1,38 +1,180 @@
+import queue
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from utils.rate_limit import TokenBucket
+
+CLOUDFLARE_API_URL = "https://api.cloudflare.com/client/v4"
+# Cloudflare 全域限制為每 5 分鐘 1200 個請求
+DEFAULT_RATE_LIMIT = 4.0
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_PER_PAGE = 100
+DEFAULT_TIMEOUT = 30
+MAX_RETRIES = 3
 
 
 class CloudflareManager:
-    def __init__(self, api_key, email):
+    def __init__(
+        self,
+        api_key,
+        email,
+        base_url=CLOUDFLARE_API_URL,
+        max_workers=DEFAULT_MAX_WORKERS,
+        rate_limit=DEFAULT_RATE_LIMIT,
+        per_page=DEFAULT_PER_PAGE,
+    ):
         self.api_key = api_key
         self.email = email
-        self.base_url = "https://api.cloudflare.com/client/v4/zones"
+        self.base_url = f"{base_url.rstrip('/')}/zones"
+        self.max_workers = max_workers
+        self.per_page = per_page
+        self.rate_limiter = TokenBucket(rate_limit)
+        self.session = self.create_session()
 
-    def fetch_all_domains_and_records(self):
-        headers = {
-            "X-Auth-Email": self.email,
-            "X-Auth-Key": self.api_key,
-            "Content-Type": "application/json",
-        }
-
-        response = requests.get(self.base_url, headers=headers)
-        zones = response.json().get("result", [])
-        all_domains_info = []
-
-        for zone in zones:
-            domain_name = zone["name"]
-            records_url = f"{self.base_url}/{zone['id']}/dns_records"
-            records_response = requests.get(records_url, headers=headers)
-            records = records_response.json().get("result", [])
-
-            for record in records:
-                if record["type"] in ["A", "CNAME"] and not record.get('proxied', False):
-                    subdomain = record["name"]
-                    if subdomain.startswith("_"):
-                        continue
-                    if domain_name == subdomain:
+    def create_session(self):
+        # 共用連線池，同一個 zone 的分頁請求會重用 keep-alive 連線
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.max_workers
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(
+            {
+                "X-Auth-Email": self.email,
+                "X-Auth-Key": self.api_key,
+                "Content-Type": "application/json",
+            }
+        )
+        return session
+
+    def get(self, url, params):
+        for attempt in range(MAX_RETRIES + 1):
+            self.rate_limiter.acquire()
+            response = self.session.get(url, params=params, timeout=DEFAULT_TIMEOUT)
+            if response.status_code != 429 or attempt == MAX_RETRIES:
+                break
+            # 超過配額時依 Retry-After 暫停所有請求
+            retry_after = float(response.headers.get("Retry-After", 1))
+            self.rate_limiter.pause(retry_after)
+        response.raise_for_status()
+        return response.json()
+
+    def iter_pages(self, url, params=None):
+        # 依 result_info 逐頁讀取，直到最後一頁
+        page = 1
+        while True:
+            data = self.get(
+                url, dict(params or {}, page=page, per_page=self.per_page)
+            )
+            yield data.get("result", [])
+            total_pages = data.get("result_info", {}).get("total_pages", 1)
+            if page >= total_pages:
+                break
+            page += 1
+
+    def iter_zones(self):
+        for zones in self.iter_pages(self.base_url):
+            yield from zones
+
+    def is_monitored(self, domain_name, record):
+        if record["type"] in ["A", "CNAME"] and not record.get('proxied', False):
+            subdomain = record["name"]
+            if subdomain.startswith("_"):
+                return False
+            if domain_name == subdomain:
+                return False
+            return True
+        return False
+
+    def filter_records(self, domain_name, records):
+        for record in records:
+            if self.is_monitored(domain_name, record):
+                yield (domain_name, record["name"])
+
+    def fetch_zone_listing(self, zone):
+        # 只保留同步比對需要的欄位
+        records_url = f"{self.base_url}/{zone['id']}/dns_records"
+        return [
+            {
+                "name": record["name"],
+                "type": record["type"],
+                "proxied": record.get("proxied", False),
+                "modified_on": record.get("modified_on"),
+            }
+            for records in self.iter_pages(records_url)
+            for record in records
+        ]
+
+    def fetch_zone_listings(self, zones):
+        """並行取得多個 zone 的完整 DNS 紀錄，依完成順序回傳 (zone, records)。"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.fetch_zone_listing, zone): zone for zone in zones
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def fetch_zone_records(self, zone, results, stopped):
+        records_url = f"{self.base_url}/{zone['id']}/dns_records"
+        for records in self.iter_pages(records_url):
+            for item in self.filter_records(zone["name"], records):
+                # 呼叫端提早停止讀取時不再阻塞在佇列上
+                while not stopped.is_set():
+                    try:
+                        results.put(item, timeout=1)
+                        break
+                    except queue.Full:
                         continue
-                    all_domains_info.append((domain_name, subdomain))
-        return all_domains_info
+            if stopped.is_set():
+                return
+
+    def iter_domains_and_records(self):
+        """
+        並行讀取所有 zone 的 DNS 紀錄，每讀到一頁就把 (domain, subdomain) 送出。
+
+        全部請求共用同一個 token bucket，並行數由 max_workers 限制。
+        """
+        results = queue.Queue(maxsize=self.per_page * self.max_workers)
+        finished = object()
+        errors = []
+        stopped = threading.Event()
+
+        def produce():
+            try:
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    futures = [
+                        executor.submit(
+                            self.fetch_zone_records, zone, results, stopped
+                        )
+                        for zone in self.iter_zones()
+                        if not stopped.is_set()
+                    ]
+                    for future in futures:
+                        future.result()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                stopped.set()
+                results.put(finished)
+
+        threading.Thread(target=produce, daemon=True).start()
+        try:
+            while True:
+                item = results.get()
+                if item is finished:
+                    break
+                yield item
+        finally:
+            stopped.set()
+            while not results.empty():
+                results.get_nowait()
+        if errors:
+            raise errors[0]
+
+    def fetch_all_domains_and_records(self):
+        return list(self.iter_domains_and_records())
 
     def convert_domains_to_dict(self, domain_tuples):
         domain_dict = {}
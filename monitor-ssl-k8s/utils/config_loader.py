@@ -11,32 +11,162 @@ class YamlConfigLoader:
             return yaml.safe_load(file)
 
     def get_mongodb_config(self):
-        return {"mongodb_uri": self.config.get("mongodb_uri", None)}
+        return {
+            "mongodb_uri": self.config.get("mongodb_uri", None),
+            "collection_name": self.config.get("collection_name", "cert"),
+            "subdomain_collection": self.config.get(
+                "subdomain_collection", "cert_subdomains"
+            ),
+            "storage_layout": self.config.get("storage_layout", "embedded"),
+            "zone_cache_collection": self.config.get(
+                "zone_cache_collection", "cloudflare_zones"
+            ),
+            "alert_state_collection": self.config.get(
+                "alert_state_collection", "alert_state"
+            ),
+            "outbox_collection": self.config.get(
+                "outbox_collection", "notification_outbox"
+            ),
+            "repo_cache_size": self.config.get("repo_cache_size", 10000),
+            "inventory_mode": self.config.get("inventory_mode", "change_stream"),
+            "inventory_poll_seconds": self.config.get("inventory_poll_seconds", 60),
+            "inventory_snapshot_path": self.config.get(
+                "inventory_snapshot_path", "inventory_snapshot.json"
+            ),
+            "inventory_snapshot_seconds": self.config.get(
+                "inventory_snapshot_seconds", 30
+            ),
+        }
 
     def get_telegram_config(self):
         return {
             "telegram_bot_token": self.config.get("telegram_bot_token", None),
             "platform": self.config.get("platform", None),
             "telegram_group_id": self.config.get("telegram_group_id", None),
+            "telegram_global_rate": self.config.get("telegram_global_rate", 30),
+            "telegram_chat_rate": self.config.get("telegram_chat_rate", 1),
+            "telegram_group_rate_per_minute": self.config.get(
+                "telegram_group_rate_per_minute", 20
+            ),
+            "telegram_send_workers": self.config.get("telegram_send_workers", 8),
+            "telegram_call_timeout_seconds": self.config.get(
+                "telegram_call_timeout_seconds", 30
+            ),
+            "bot_mode": self.config.get("bot_mode", "polling"),
+            "webhook_host": self.config.get("webhook_host", "0.0.0.0"),
+            "webhook_port": self.config.get("webhook_port", 8443),
+            "webhook_path": self.config.get("webhook_path", "/telegram"),
+            "webhook_url": self.config.get("webhook_url", ""),
+            "webhook_secret": self.config.get("webhook_secret", ""),
+            "webhook_workers": self.config.get("webhook_workers", 8),
+            "webhook_queue_size": self.config.get("webhook_queue_size", 256),
         }
 
     def get_cloudflare_config(self):
         return {
             "cloudflare_email": self.config.get("cloudflare_email", None),
             "cloudflare_api_key": self.config.get("cloudflare_api_key", None),
+            "cloudflare_api_url": self.config.get(
+                "cloudflare_api_url", "https://api.cloudflare.com/client/v4"
+            ),
+            "cloudflare_max_workers": self.config.get("cloudflare_max_workers", 8),
+            "cloudflare_rate_limit": self.config.get("cloudflare_rate_limit", 4.0),
+        }
+
+    def get_probe_config(self):
+        return {
+            "probe_concurrency": self.config.get("probe_concurrency", 100),
+            "probe_timeout": self.config.get("probe_timeout", 3.0),
+            "dns_cache_ttl": self.config.get("dns_cache_ttl", 300),
+            "dns_negative_ttl": self.config.get("dns_negative_ttl", 30),
+            "happy_eyeballs_delay": self.config.get("happy_eyeballs_delay", 0.25),
+            "probe_per_ip": self.config.get("probe_per_ip", False),
+            "fanout_max_addresses": self.config.get("fanout_max_addresses", 8),
+            "pipeline_queue_size": self.config.get("pipeline_queue_size", 1000),
+            "pipeline_dedupe_size": self.config.get("pipeline_dedupe_size", 10000),
+            "mongo_batch_size": self.config.get("mongo_batch_size", 500),
+            "cert_cache_ttl": self.config.get("cert_cache_ttl", 300),
+            "cert_cache_size": self.config.get("cert_cache_size", 10000),
+        }
+
+    def get_alert_config(self):
+        return {
+            "alert_thresholds_days": self.config.get(
+                "alert_thresholds_days", [1, 7, 14, 30]
+            ),
+            "alert_cooldown_hours": self.config.get("alert_cooldown_hours", 24),
+            "outbox_poll_seconds": self.config.get("outbox_poll_seconds", 1),
+            "outbox_max_attempts": self.config.get("outbox_max_attempts", 8),
+        }
+
+    def get_scheduler_config(self):
+        return {
+            "scheduler_tick_seconds": self.config.get("scheduler_tick_seconds", 60),
+            "inventory_refresh_seconds": self.config.get(
+                "inventory_refresh_seconds", 600
+            ),
+            "max_check_interval_days": self.config.get("max_check_interval_days", 7),
+            "alert_check_interval_hours": self.config.get(
+                "alert_check_interval_hours", 24
+            ),
+            "retry_interval_seconds": self.config.get("retry_interval_seconds", 300),
+            "job_workers": self.config.get("job_workers", 2),
+            "job_progress_interval_seconds": self.config.get(
+                "job_progress_interval_seconds", 3
+            ),
         }
 
 
 class EnvConfigLoader:
     @staticmethod
     def get_mongodb_config():
-        return {"mongodb_uri": os.getenv("MONGODB_URI", "")}
+        return {
+            "mongodb_uri": os.getenv("MONGODB_URI", ""),
+            "collection_name": os.getenv("COLLECTION_NAME", "cert"),
+            "subdomain_collection": os.getenv(
+                "SUBDOMAIN_COLLECTION", "cert_subdomains"
+            ),
+            "storage_layout": os.getenv("STORAGE_LAYOUT", "embedded"),
+            "zone_cache_collection": os.getenv(
+                "ZONE_CACHE_COLLECTION", "cloudflare_zones"
+            ),
+            "alert_state_collection": os.getenv(
+                "ALERT_STATE_COLLECTION", "alert_state"
+            ),
+            "outbox_collection": os.getenv("OUTBOX_COLLECTION", "notification_outbox"),
+            "repo_cache_size": int(os.getenv("REPO_CACHE_SIZE", "10000")),
+            "inventory_mode": os.getenv("INVENTORY_MODE", "change_stream"),
+            "inventory_poll_seconds": float(os.getenv("INVENTORY_POLL_SECONDS", "60")),
+            "inventory_snapshot_path": os.getenv(
+                "INVENTORY_SNAPSHOT_PATH", "inventory_snapshot.json"
+            ),
+            "inventory_snapshot_seconds": float(
+                os.getenv("INVENTORY_SNAPSHOT_SECONDS", "30")
+            ),
+        }
 
     @staticmethod
     def get_telegram_config():
         return {
             "telegram_bot_token": os.getenv("TELEGRAM_BOT_TOKEN", ""),
             "telegram_group_id": os.getenv("TELEGRAM_GROUP_ID", ""),
+            "telegram_global_rate": float(os.getenv("TELEGRAM_GLOBAL_RATE", "30")),
+            "telegram_chat_rate": float(os.getenv("TELEGRAM_CHAT_RATE", "1")),
+            "telegram_group_rate_per_minute": float(
+                os.getenv("TELEGRAM_GROUP_RATE_PER_MINUTE", "20")
+            ),
+            "telegram_send_workers": int(os.getenv("TELEGRAM_SEND_WORKERS", "8")),
+            "telegram_call_timeout_seconds": float(
+                os.getenv("TELEGRAM_CALL_TIMEOUT_SECONDS", "30")
+            ),
+            "bot_mode": os.getenv("BOT_MODE", "polling"),
+            "webhook_host": os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+            "webhook_port": int(os.getenv("WEBHOOK_PORT", "8443")),
+            "webhook_path": os.getenv("WEBHOOK_PATH", "/telegram"),
+            "webhook_url": os.getenv("WEBHOOK_URL", ""),
+            "webhook_secret": os.getenv("WEBHOOK_SECRET", ""),
+            "webhook_workers": int(os.getenv("WEBHOOK_WORKERS", "8")),
+            "webhook_queue_size": int(os.getenv("WEBHOOK_QUEUE_SIZE", "256")),
         }
 
     @staticmethod
@@ -44,4 +174,56 @@ class EnvConfigLoader:
         return {
             "cloudflare_email": os.getenv("CLOUDFLARE_EMAIL", ""),
             "cloudflare_api_key": os.getenv("CLOUDFLARE_API_KEY", ""),
+            "cloudflare_api_url": os.getenv(
+                "CLOUDFLARE_API_URL", "https://api.cloudflare.com/client/v4"
+            ),
+            "cloudflare_max_workers": int(os.getenv("CLOUDFLARE_MAX_WORKERS", "8")),
+            "cloudflare_rate_limit": float(os.getenv("CLOUDFLARE_RATE_LIMIT", "4.0")),
+        }
+
+    @staticmethod
+    def get_probe_config():
+        return {
+            "probe_concurrency": int(os.getenv("PROBE_CONCURRENCY", "100")),
+            "probe_timeout": float(os.getenv("PROBE_TIMEOUT", "3.0")),
+            "dns_cache_ttl": int(os.getenv("DNS_CACHE_TTL", "300")),
+            "dns_negative_ttl": int(os.getenv("DNS_NEGATIVE_TTL", "30")),
+            "happy_eyeballs_delay": float(os.getenv("HAPPY_EYEBALLS_DELAY", "0.25")),
+            "probe_per_ip": os.getenv("PROBE_PER_IP", "false").lower() == "true",
+            "fanout_max_addresses": int(os.getenv("FANOUT_MAX_ADDRESSES", "8")),
+            "pipeline_queue_size": int(os.getenv("PIPELINE_QUEUE_SIZE", "1000")),
+            "pipeline_dedupe_size": int(os.getenv("PIPELINE_DEDUPE_SIZE", "10000")),
+            "mongo_batch_size": int(os.getenv("MONGO_BATCH_SIZE", "500")),
+            "cert_cache_ttl": int(os.getenv("CERT_CACHE_TTL", "300")),
+            "cert_cache_size": int(os.getenv("CERT_CACHE_SIZE", "10000")),
+        }
+
+    @staticmethod
+    def get_alert_config():
+        return {
+            "alert_thresholds_days": [
+                int(days)
+                for days in os.getenv("ALERT_THRESHOLDS_DAYS", "1,7,14,30").split(",")
+            ],
+            "alert_cooldown_hours": float(os.getenv("ALERT_COOLDOWN_HOURS", "24")),
+            "outbox_poll_seconds": float(os.getenv("OUTBOX_POLL_SECONDS", "1")),
+            "outbox_max_attempts": int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8")),
+        }
+
+    @staticmethod
+    def get_scheduler_config():
+        return {
+            "scheduler_tick_seconds": int(os.getenv("SCHEDULER_TICK_SECONDS", "60")),
+            "inventory_refresh_seconds": int(
+                os.getenv("INVENTORY_REFRESH_SECONDS", "600")
+            ),
+            "max_check_interval_days": int(os.getenv("MAX_CHECK_INTERVAL_DAYS", "7")),
+            "alert_check_interval_hours": int(
+                os.getenv("ALERT_CHECK_INTERVAL_HOURS", "24")
+            ),
+            "retry_interval_seconds": int(os.getenv("RETRY_INTERVAL_SECONDS", "300")),
+            "job_workers": int(os.getenv("JOB_WORKERS", "2")),
+            "job_progress_interval_seconds": float(
+                os.getenv("JOB_PROGRESS_INTERVAL_SECONDS", "3")
+            ),
         }
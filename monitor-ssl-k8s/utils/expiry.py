@@ -0,0 +1,58 @@
+import ssl
+import time
+import numpy as np
+
+DAY = 86400
+DEFAULT_THRESHOLDS_DAYS = (1, 7, 14, 30)
+EXPIRED = "expired"
+
+
+def cert_expiry_timestamp(probe_result=None, cert=None):
+    # DER 解析結果已經帶有 epoch，只有 getpeercert() 格式才需要解析字串
+    if probe_result is not None and probe_result.get("not_after_ts") is not None:
+        return probe_result["not_after_ts"]
+    if cert is not None:
+        return ssl.cert_time_to_seconds(cert["notAfter"])
+    return None
+
+
+def bucket_labels(thresholds_days):
+    return [EXPIRED] + [f"{days}d" for days in sorted(thresholds_days)]
+
+
+def classify_expiries(expire_timestamps, thresholds_days=DEFAULT_THRESHOLDS_DAYS, now=None):
+    """
+    一次把整輪的到期時間分到各告警區間。
+
+    回傳 (bucket_index, remaining_days)：bucket_index 對應 bucket_labels() 的位置，
+    超過最大門檻的為 -1。
+    """
+    now = time.time() if now is None else now
+    expire_timestamps = np.asarray(expire_timestamps, dtype=np.float64)
+    thresholds = np.sort(np.asarray(thresholds_days, dtype=np.int64))
+    remaining_days = np.floor((expire_timestamps - now) / DAY).astype(np.int64)
+
+    # searchsorted 找出第一個 >= 剩餘天數的門檻，+1 讓出 expired 的位置
+    bucket_index = np.searchsorted(thresholds, remaining_days, side="left") + 1
+    bucket_index[bucket_index > len(thresholds)] = -1
+    bucket_index[expire_timestamps <= now] = 0
+    return bucket_index, remaining_days
+
+
+def group_by_bucket(names, expire_timestamps, thresholds_days=DEFAULT_THRESHOLDS_DAYS, now=None):
+    """回傳 {bucket_label: [(name, expire_timestamp, remaining_days), ...]}，只包含需要告警的區間。"""
+    labels = bucket_labels(thresholds_days)
+    if not names:
+        return {}
+    bucket_index, remaining_days = classify_expiries(
+        expire_timestamps, thresholds_days, now
+    )
+    buckets = {}
+    for index, label in enumerate(labels):
+        positions = np.flatnonzero(bucket_index == index)
+        if len(positions):
+            buckets[label] = [
+                (names[i], expire_timestamps[i], int(remaining_days[i]))
+                for i in positions
+            ]
+    return buckets
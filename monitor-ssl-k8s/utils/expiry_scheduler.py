@@ -0,0 +1,108 @@
+import heapq
+import threading
+import time
+
+DAY = 86400
+
+
+class ExpiryScheduler:
+    """
+    以 min-heap 依到期時間排程每個 subdomain 的下一次檢查。
+
+    告警區間以外最久 max_interval 檢查一次；進入最大的告警門檻後，
+    每個區間依門檻天數等比例縮短間隔（30 天區間為 alert_interval，
+    7 天區間約為其 7/30），越接近到期檢查得越頻繁。
+    """
+
+    def __init__(
+        self,
+        thresholds_days=(1, 7, 14, 30),
+        max_interval=7 * DAY,
+        alert_interval=DAY,
+        retry_interval=300,
+        min_interval=60,
+    ):
+        self.thresholds = sorted(days * DAY for days in thresholds_days)
+        self.alert_seconds = self.thresholds[-1]
+        self.max_interval = max_interval
+        self.alert_interval = alert_interval
+        self.retry_interval = retry_interval
+        self.min_interval = min_interval
+        self.heap = []
+        self.due_at = {}
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.due_at)
+
+    def _push(self, subdomain, due_at):
+        self.due_at[subdomain] = due_at
+        heapq.heappush(self.heap, (due_at, subdomain))
+
+    def sync(self, subdomains, now=None):
+        # 新增的 subdomain 立即到期；被刪除或停用的只從 due_at 移除，heap 內的舊項目在 pop 時略過
+        now = time.time() if now is None else now
+        subdomains = set(subdomains)
+        with self.lock:
+            for subdomain in subdomains - self.due_at.keys():
+                self._push(subdomain, now)
+            for subdomain in self.due_at.keys() - subdomains:
+                del self.due_at[subdomain]
+                self.failures.pop(subdomain, None)
+
+    def pop_due(self, now=None):
+        now = time.time() if now is None else now
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                due_at, subdomain = heapq.heappop(self.heap)
+                if self.due_at.get(subdomain) == due_at:
+                    due.append(subdomain)
+        return due
+
+    def next_interval(self, expire_at, failures, now):
+        if failures:
+            # 連續失敗時指數退避，但不會比告警期間的檢查頻率更慢
+            interval = min(
+                self.retry_interval * 2 ** (failures - 1), self.alert_interval
+            )
+        else:
+            remaining = expire_at - now
+            if remaining > self.alert_seconds:
+                # 至少在剩餘天數進入告警門檻時再檢查一次
+                interval = min(remaining - self.alert_seconds, self.max_interval)
+            else:
+                interval = self.bucket_interval(remaining)
+        return max(interval, self.min_interval)
+
+    def bucket_interval(self, remaining):
+        # 已過期的證書以最短的間隔檢查，更新後能盡快解除告警
+        if remaining <= 0:
+            return self.alert_interval * self.thresholds[0] / self.alert_seconds
+        lower = 0
+        for threshold in self.thresholds:
+            if remaining <= threshold:
+                # 在進入下一個更小的區間時再檢查一次
+                return min(
+                    self.alert_interval * threshold / self.alert_seconds,
+                    remaining - lower,
+                )
+            lower = threshold
+        return self.alert_interval
+
+    def reschedule(self, subdomain, expire_at, now=None):
+        # expire_at 為 None 代表這次探測失敗
+        now = time.time() if now is None else now
+        with self.lock:
+            if subdomain not in self.due_at:
+                return None
+            if expire_at is None:
+                failures = self.failures.get(subdomain, 0) + 1
+                self.failures[subdomain] = failures
+            else:
+                failures = 0
+                self.failures.pop(subdomain, None)
+            due_at = now + self.next_interval(expire_at, failures, now)
+            self._push(subdomain, due_at)
+            return due_at
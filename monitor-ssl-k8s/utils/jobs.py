@@ -0,0 +1,195 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.notifier import split_message
+
+JOB_RUNNING = "執行中"
+JOB_DONE = "已完成"
+JOB_FAILED = "失敗"
+DEFAULT_MAX_WORKERS = 2
+DEFAULT_UPDATE_INTERVAL = 3
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} 小時 {seconds % 3600 // 60} 分"
+    if seconds >= 60:
+        return f"{seconds // 60} 分 {seconds % 60} 秒"
+    return f"{seconds} 秒"
+
+
+class JobProgress:
+    """工作進度，由執行中的工作更新、進度訊息讀取。"""
+
+    def __init__(self):
+        self.stage = None
+        self.done = 0
+        self.total = 0
+        self.failures = 0
+        self.started_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_stage(self, stage, total=0):
+        with self.lock:
+            self.stage = stage
+            self.done = 0
+            self.total = total
+            self.started_at = time.monotonic()
+
+    def add_total(self, count=1):
+        with self.lock:
+            self.total += count
+
+    def advance(self, count=1, failed=False):
+        with self.lock:
+            self.done += count
+            if failed:
+                self.failures += count
+
+    def track(self, iterable):
+        # 總數未知的串流，每讀到一筆就前進一步
+        for item in iterable:
+            self.advance()
+            yield item
+
+    def render(self):
+        with self.lock:
+            lines = []
+            if self.stage:
+                lines.append(f"階段: {self.stage}")
+            if self.total:
+                percent = self.done * 100 // self.total
+                lines.append(f"進度: {self.done}/{self.total} ({percent}%)")
+            else:
+                lines.append(f"進度: {self.done}")
+            lines.append(f"失敗: {self.failures}")
+            if 0 < self.done < self.total:
+                elapsed = time.monotonic() - self.started_at
+                eta = elapsed / self.done * (self.total - self.done)
+                lines.append(f"預估剩餘: {format_duration(eta)}")
+            return "\n".join(lines)
+
+
+class Job:
+    def __init__(self, job_id, key, title):
+        self.id = job_id
+        self.key = key
+        self.title = title
+        self.status = JOB_RUNNING
+        self.progress = JobProgress()
+        self.result = None
+        # (chat_id, message_id, 上次送出的內容)，同一個工作可以有多個 chat 在等
+        self.watchers = []
+        self.started_at = time.monotonic()
+
+    def render(self):
+        elapsed = format_duration(time.monotonic() - self.started_at)
+        return (
+            f"工作 #{self.id} {self.title} {self.status}（已執行 {elapsed}）\n"
+            f"{self.progress.render()}"
+        )
+
+
+class JobManager:
+    """
+    把耗時的指令放到背景 worker pool 執行，立即回覆工作編號，
+    並定期就地編輯同一則進度訊息。同一個 key 的工作執行中時，重複的請求會直接加入該工作。
+    """
+
+    def __init__(
+        self,
+        bot,
+        max_workers=DEFAULT_MAX_WORKERS,
+        update_interval=DEFAULT_UPDATE_INTERVAL,
+    ):
+        self.bot = bot
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.update_interval = update_interval
+        self.ids = itertools.count(1)
+        self.running = {}
+        self.lock = threading.Lock()
+        self.ticker = None
+
+    def submit(self, key, title, func, message):
+        """func(progress) 回傳要回覆給使用者的報告文字。"""
+        # 在同一個 lock 內加入 watcher，工作結束時一定會通知到
+        watcher = [message.chat.id, None, None, message]
+        with self.lock:
+            job = self.running.get(key)
+            attached = job is not None
+            if not attached:
+                job = Job(next(self.ids), key, title)
+                self.running[key] = job
+            job.watchers.append(watcher)
+        if attached:
+            text = f"相同的工作 #{job.id} 正在執行，完成後會一併通知。\n{job.render()}"
+        else:
+            text = job.render()
+        try:
+            reply = self.bot.reply_to(message, text)
+            watcher[2] = text
+            watcher[1] = reply.message_id
+        finally:
+            # 回覆失敗時工作仍照常執行，否則已登記的 key 會一直擋住之後的請求
+            if not attached:
+                self.start(job, func)
+        return job
+
+    def start(self, job, func):
+        try:
+            self.start_ticker()
+            self.executor.submit(self.run, job, func)
+        except Exception:
+            with self.lock:
+                if self.running.get(job.key) is job:
+                    del self.running[job.key]
+            raise
+
+    def run(self, job, func):
+        try:
+            report = func(job.progress)
+            job.status = JOB_DONE
+        except Exception as e:
+            report = str(e)
+            job.status = JOB_FAILED
+        with self.lock:
+            del self.running[job.key]
+        job.result = report
+        self.refresh(job)
+        chunks = split_message(f"工作 #{job.id} {job.title} {job.status}\n{report}")
+        for chat_id, _, _, message in job.watchers:
+            # 某個 chat 送不出去時，其他加入同一工作的使用者仍要收到報告
+            try:
+                for chunk in chunks:
+                    self.bot.reply_to(message, chunk)
+            except Exception as e:
+                print(f"回覆工作 #{job.id} 結果給 chat {chat_id} 失敗: {e}")
+
+    def refresh(self, job):
+        text = job.render()
+        for watcher in job.watchers:
+            chat_id, message_id, last_text, _ = watcher
+            if message_id is None or text == last_text:
+                continue
+            try:
+                self.bot.edit_message_text(text, chat_id, message_id)
+                watcher[2] = text
+            except Exception as e:
+                print(f"更新工作 #{job.id} 進度失敗: {e}")
+
+    def start_ticker(self):
+        with self.lock:
+            if self.ticker is not None:
+                return
+            self.ticker = threading.Thread(target=self.tick, daemon=True)
+            self.ticker.start()
+
+    def tick(self):
+        while True:
+            time.sleep(self.update_interval)
+            with self.lock:
+                jobs = list(self.running.values())
+            for job in jobs:
+                self.refresh(job)
@@ -0,0 +1,126 @@
+import requests
+from datetime import datetime
+from requests.adapters import HTTPAdapter
+from utils.expiry import EXPIRED
+from utils.telegram_gateway import PRIORITY_ALERT, RetryAfter
+
+TELEGRAM_API_URL = "https://api.telegram.org"
+TELEGRAM_MESSAGE_LIMIT = 4096
+DEFAULT_TIMEOUT = 10
+
+
+def split_message(text, limit=TELEGRAM_MESSAGE_LIMIT, header=""):
+    """依行切割成不超過 limit 的訊息，續頁開頭會重複 header。"""
+    width = limit - len(header) - 1 if header else limit
+    pieces = []
+    for line in text.split("\n"):
+        # 單行本身就超過上限時直接硬切
+        pieces.extend(line[i : i + width] for i in range(0, max(len(line), 1), width))
+    chunks = []
+    current = None
+    for piece in pieces:
+        if current is None:
+            current = piece
+        elif len(current) + 1 + len(piece) <= limit:
+            current += "\n" + piece
+        else:
+            chunks.append(current)
+            current = f"{header}\n{piece}" if header else piece
+    if current is not None:
+        chunks.append(current)
+    return chunks
+
+
+class TelegramNotifier:
+    def __init__(self, bot_token, chat_id, gateway=None, api_url=TELEGRAM_API_URL):
+        self.chat_id = chat_id
+        self.gateway = gateway
+        self.send_message_url = f"{api_url.rstrip('/')}/bot{bot_token}/sendMessage"
+        # 所有通知共用同一個 session，重用 keep-alive 連線
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def post(self, chat_id, text):
+        response = self.session.post(
+            self.send_message_url,
+            data={"chat_id": chat_id, "text": text},
+            timeout=DEFAULT_TIMEOUT,
+        )
+        if response.status_code == 429:
+            retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+            raise RetryAfter(retry_after)
+        return response.status_code == 200
+
+    def send(self, text, chat_id=None, priority=PRIORITY_ALERT):
+        chat_id = chat_id or self.chat_id
+        if self.gateway is None:
+            return self.post(chat_id, text)
+        # 經過 gateway 排隊與限流，429 也由 gateway 依 retry_after 重送
+        return self.gateway.call(chat_id, self.post, chat_id, text, priority=priority)
+
+
+class ExpiryDigest:
+    """彙整一輪巡檢中所有到期告警，依 platform / domain / 告警區間分組成少數幾則訊息。"""
+
+    def __init__(self, platform=None, thresholds_days=None):
+        self.platform = platform
+        self.findings = {}
+        self.severity_order = [EXPIRED] + [
+            f"{days}d" for days in sorted(thresholds_days or [])
+        ]
+
+    def __len__(self):
+        return sum(
+            len(items)
+            for domains in self.findings.values()
+            for items in domains.values()
+        )
+
+    def add(self, subdomain, domain, expire_at, remaining_days, bucket):
+        self.findings.setdefault(bucket, {}).setdefault(domain or "-", []).append(
+            (subdomain, expire_at, remaining_days)
+        )
+
+    def severity_key(self, bucket):
+        if bucket in self.severity_order:
+            return self.severity_order.index(bucket)
+        return len(self.severity_order)
+
+    def header(self):
+        title = "標題: 憑證到期摘要"
+        if self.platform:
+            title += f" ({self.platform})"
+        return f"來源: Cloudflare\n{title}"
+
+    def render(self):
+        lines = []
+        for bucket in sorted(self.findings, key=self.severity_key):
+            domains = self.findings[bucket]
+            count = sum(len(items) for items in domains.values())
+            label = "已過期" if bucket == EXPIRED else f"{bucket} 內到期"
+            lines.append(f"\n[{label}] {count} 筆")
+            for domain in sorted(domains):
+                lines.append(f"主域名: {domain}")
+                for subdomain, expire_at, remaining_days in sorted(
+                    domains[domain], key=lambda item: item[1]
+                ):
+                    expire_date = datetime.utcfromtimestamp(expire_at)
+                    lines.append(
+                        f"  {subdomain}  到期日: {expire_date.strftime('%Y-%m-%d')}"
+                        f"  剩餘天數: {remaining_days}"
+                    )
+        return "\n".join(lines)
+
+    def messages(self):
+        if not self.findings:
+            return []
+        header = self.header()
+        return split_message(f"{header}\n{self.render()}", header=header)
+
+    def send(self, notifier):
+        messages = self.messages()
+        delivered = [notifier.send(message) for message in messages]
+        print(f"已發送 {len(self)} 筆到期告警，共 {len(messages)} 則訊息")
+        return all(delivered)
@@ -0,0 +1,105 @@
+import hashlib
+import threading
+import time
+from utils.telegram_gateway import PRIORITY_ALERT
+
+DEFAULT_POLL_SECONDS = 1
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 8
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+
+
+def alert_window(cooldown_seconds, now):
+    # 間隔超過冷卻時間的兩次通知一定落在不同區間；沒有冷卻時間時每一輪各自獨立
+    if cooldown_seconds <= 0:
+        return now
+    return int(now // cooldown_seconds)
+
+
+def idempotency_key(chat_id, alerts, window, text):
+    """
+    以告警本身（subdomain、domain、區間、到期時間）加上冷卻區間產生 key，
+    同一區間內重跑或重啟後重複寫入只會送一次，冷卻時間過後的再次告警則是新的一則。
+    """
+    identity = sorted(
+        (subdomain, domain or "", bucket, float(expire_at))
+        for subdomain, domain, expire_at, _, bucket in alerts
+    )
+    return hashlib.sha256(f"{chat_id}\n{window}\n{identity}\n{text}".encode()).hexdigest()
+
+
+def enqueue_messages(
+    outbox, chat_id, texts, alerts, window, priority=PRIORITY_ALERT, now=None
+):
+    """回傳實際新寫入的訊息數，已存在的 key 不算。"""
+    now = time.time() if now is None else now
+    return outbox.enqueue(
+        [
+            (idempotency_key(chat_id, alerts, window, text), chat_id, text, priority)
+            for text in texts
+        ],
+        now,
+    )
+
+
+class OutboxWorker:
+    """在背景持續消化 outbox，送出失敗時以指數退避重試，與探測流程完全分開。"""
+
+    def __init__(
+        self,
+        outbox,
+        notifier,
+        poll_seconds=DEFAULT_POLL_SECONDS,
+        lease_seconds=DEFAULT_LEASE_SECONDS,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+    ):
+        self.outbox = outbox
+        self.notifier = notifier
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def retry_delay(self, attempts):
+        return min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+
+    def deliver(self, item):
+        try:
+            delivered = self.notifier.send(
+                item["text"], item["chat_id"], item.get("priority", PRIORITY_ALERT)
+            )
+            error = None if delivered else "Telegram 回傳失敗"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        now = time.time()
+        if error is None:
+            self.outbox.mark_sent(item["_id"], now)
+        elif item["attempts"] >= self.max_attempts:
+            print(f"通知 {item['_id'][:12]} 已重試 {item['attempts']} 次仍失敗：{error}")
+            self.outbox.mark_failed(item["_id"], error)
+        else:
+            self.outbox.mark_retry(
+                item["_id"], now + self.retry_delay(item["attempts"]), error
+            )
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                item = self.outbox.claim(time.time(), self.lease_seconds)
+            except Exception as e:
+                print(f"讀取 outbox 失敗: {e}")
+                item = None
+            if item is None:
+                self.stopped.wait(self.poll_seconds)
+                continue
+            self.deliver(item)
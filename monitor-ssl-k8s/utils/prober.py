@@ -0,0 +1,281 @@
+import asyncio
+import ssl
+from utils.cert import (
+    connect_happy_eyeballs,
+    describe_der_cert,
+    get_ssl_context,
+    open_host_socket,
+    prefetch_hosts,
+    resolve_host_async,
+)
+
+DEFAULT_CONCURRENCY = 100
+DEFAULT_TIMEOUT = 3.0
+DEFAULT_FANOUT_MAX_ADDRESSES = 8
+READ_SIZE = 16384
+
+
+class _TLSConnection:
+    # 以 MemoryBIO 自己驅動握手，拿到證書後可以直接中斷，不必等待 close_notify
+    def __init__(self, reader, writer, ssl_object, incoming, outgoing):
+        self.reader = reader
+        self.writer = writer
+        self.ssl_object = ssl_object
+        self.incoming = incoming
+        self.outgoing = outgoing
+
+    async def flush(self):
+        data = self.outgoing.read()
+        if data:
+            self.writer.write(data)
+            await self.writer.drain()
+
+    async def feed(self):
+        data = await self.reader.read(READ_SIZE)
+        if not data:
+            raise ssl.SSLEOFError("連線在握手完成前被關閉")
+        self.incoming.write(data)
+
+    async def do_handshake(self):
+        while True:
+            try:
+                self.ssl_object.do_handshake()
+                break
+            except ssl.SSLWantReadError:
+                await self.flush()
+                await self.feed()
+        await self.flush()
+
+    def abort(self):
+        # 只需要握手結果，直接中斷連線不等待 close_notify
+        self.writer.transport.abort()
+
+
+async def open_tls_connection(domain, port=443, ssl_context=None, addrinfo=None):
+    ssl_context = ssl_context or get_ssl_context()
+    if addrinfo is None:
+        sock = await open_host_socket(domain, port)
+    else:
+        # 指定連到某個 IP，SNI 仍然使用 domain
+        sock = await connect_happy_eyeballs([addrinfo])
+    reader, writer = await asyncio.open_connection(sock=sock)
+    incoming = ssl.MemoryBIO()
+    outgoing = ssl.MemoryBIO()
+    # 刻意不做 session resumption：resume 的握手不帶 Certificate，
+    # getpeercert() 會回傳原 session 的舊證書，看不到更新、回滾或個別節點的差異
+    ssl_object = ssl_context.wrap_bio(incoming, outgoing, server_hostname=domain)
+    conn = _TLSConnection(reader, writer, ssl_object, incoming, outgoing)
+    try:
+        await conn.do_handshake()
+    except BaseException:
+        conn.abort()
+        raise
+    return conn
+
+
+def _peer_chain(ssl_object, verified):
+    # get_verified_chain / get_unverified_chain 需要 Python 3.13 以上
+    method = "get_verified_chain" if verified else "get_unverified_chain"
+    if not hasattr(ssl_object, method):
+        return []
+    return list(getattr(ssl_object, method)() or [])
+
+
+async def _capture_peer_der(
+    domain, port, ssl_context, timeout, verified, addrinfo=None
+):
+    conn = await asyncio.wait_for(
+        open_tls_connection(domain, port, ssl_context, addrinfo), timeout
+    )
+    try:
+        der = conn.ssl_object.getpeercert(binary_form=True)
+        return der, _peer_chain(conn.ssl_object, verified)
+    finally:
+        conn.abort()
+
+
+async def inspect_ssl_cert(domain, timeout=DEFAULT_TIMEOUT, port=443):
+    """取得 domain 的 DER 證書與憑證鏈，並回傳驗證結果與解析後的欄位。"""
+    result = {
+        "domain": domain,
+        "verified": False,
+        "verify_error": None,
+        "error": None,
+        "cert": None,
+        "der": None,
+        "chain": [],
+    }
+    try:
+        der, chain = await _capture_peer_der(
+            domain, port, get_ssl_context(), timeout, verified=True
+        )
+        result["verified"] = True
+    except ssl.SSLCertVerificationError as e:
+        # 驗證失敗（過期、自簽等）時仍要拿到證書內容，改用不驗證的 context 取回
+        result["verify_error"] = e.verify_message or str(e)
+        try:
+            der, chain = await _capture_peer_der(
+                domain, port, get_ssl_context(verify=False), timeout, verified=False
+            )
+        except Exception as e:
+            result["error"] = str(e) or type(e).__name__
+            return result
+    except Exception as e:
+        result["error"] = str(e) or type(e).__name__
+        return result
+    result["der"] = der
+    result["chain"] = chain
+    result.update(describe_der_cert(der))
+    return result
+
+
+def probe_ssl_cert(domain, timeout=DEFAULT_TIMEOUT):
+    return asyncio.run(inspect_ssl_cert(domain, timeout))
+
+
+async def fetch_ssl_cert_probes(
+    domains, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, on_result=None
+):
+    # 用 semaphore 限制同時進行中的握手數量
+    semaphore = asyncio.Semaphore(concurrency)
+    await prefetch_hosts(domains, concurrency=concurrency)
+
+    async def probe(domain):
+        async with semaphore:
+            result = await inspect_ssl_cert(domain, timeout)
+        if on_result is not None:
+            on_result(domain, result)
+        return domain, result
+
+    # 重複的 domain 只握手一次
+    unique_domains = dict.fromkeys(domains)
+    results = await asyncio.gather(*(probe(domain) for domain in unique_domains))
+    return dict(results)
+
+
+def get_ssl_cert_probes(
+    domains, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, on_result=None
+):
+    """並行檢查多個 domain，回傳 {domain: inspect_ssl_cert 的結果}。"""
+    return asyncio.run(fetch_ssl_cert_probes(domains, concurrency, timeout, on_result))
+
+
+async def fetch_ssl_cert_from_ip(domain, addrinfo, timeout=DEFAULT_TIMEOUT, port=443):
+    endpoint = {
+        "ip": addrinfo[4][0],
+        "not_after": None,
+        "fingerprint": None,
+        "verified": False,
+        "verify_error": None,
+        "error": None,
+        "cert": None,
+    }
+    try:
+        der, _ = await _capture_peer_der(
+            domain, port, get_ssl_context(), timeout, False, addrinfo
+        )
+        endpoint["verified"] = True
+    except ssl.SSLCertVerificationError as e:
+        # 與 inspect_ssl_cert 相同，驗證失敗的節點仍要取回證書，過期節點才會被告警
+        endpoint["verify_error"] = e.verify_message or str(e)
+        try:
+            der, _ = await _capture_peer_der(
+                domain, port, get_ssl_context(verify=False), timeout, False, addrinfo
+            )
+        except Exception as e:
+            endpoint["error"] = str(e) or type(e).__name__
+            return endpoint
+    except Exception as e:
+        endpoint["error"] = str(e) or type(e).__name__
+        return endpoint
+    description = describe_der_cert(der)
+    endpoint["cert"] = description["cert"]
+    endpoint["not_after"] = description["cert"]["notAfter"]
+    endpoint["fingerprint"] = description["fingerprint"]
+    return endpoint
+
+
+def _unique_addresses(addrinfos, max_addresses):
+    unique = {}
+    for addrinfo in addrinfos:
+        unique.setdefault(addrinfo[4][0], addrinfo)
+    return list(unique.values())[:max_addresses]
+
+
+async def fetch_ssl_cert_fanout(
+    domain,
+    timeout=DEFAULT_TIMEOUT,
+    port=443,
+    max_addresses=DEFAULT_FANOUT_MAX_ADDRESSES,
+):
+    """對 domain 的每個 A/AAAA 位址各握手一次，回報各 IP 的證書是否一致。"""
+    try:
+        addrinfos = await resolve_host_async(domain, port)
+    except OSError as e:
+        return {
+            "cert": None,
+            "endpoints": [],
+            "divergent": False,
+            "unreachable": [],
+            "verify_error": None,
+            "error": str(e) or type(e).__name__,
+        }
+
+    # 同一個 domain 的所有 IP 同時握手，整體耗時仍約等於一次握手
+    endpoints = await asyncio.gather(
+        *(
+            fetch_ssl_cert_from_ip(domain, addrinfo, timeout, port)
+            for addrinfo in _unique_addresses(addrinfos, max_addresses)
+        )
+    )
+    certs = [endpoint.pop("cert") for endpoint in endpoints]
+    valid = [cert for cert in certs if cert is not None]
+    fingerprints = {e["fingerprint"] for e in endpoints if e["fingerprint"]}
+    verify_errors = [e["verify_error"] for e in endpoints if e["verify_error"]]
+    # 連不上的節點（例如沒有 IPv6 路由）是網路問題，不算證書不一致
+    unreachable = [e for e in endpoints if e["fingerprint"] is None]
+    errors = [e["error"] for e in unreachable if e["error"]]
+    return {
+        # 以最早到期的證書做到期判斷，才不會漏掉還沒更新的節點
+        "cert": min(valid, key=lambda c: ssl.cert_time_to_seconds(c["notAfter"]))
+        if valid
+        else None,
+        "endpoints": endpoints,
+        "divergent": len(fingerprints) > 1,
+        "unreachable": unreachable,
+        "verify_error": verify_errors[0] if verify_errors else None,
+        "error": errors[0] if errors else None,
+    }
+
+
+async def fetch_ssl_cert_fanouts(
+    domains,
+    concurrency=DEFAULT_CONCURRENCY,
+    timeout=DEFAULT_TIMEOUT,
+    max_addresses=DEFAULT_FANOUT_MAX_ADDRESSES,
+):
+    # semaphore 限制的是 domain 數，同時開啟的連線最多 concurrency * max_addresses
+    semaphore = asyncio.Semaphore(concurrency)
+    await prefetch_hosts(domains, concurrency=concurrency)
+
+    async def probe(domain):
+        async with semaphore:
+            return domain, await fetch_ssl_cert_fanout(
+                domain, timeout, max_addresses=max_addresses
+            )
+
+    # 重複的 domain 只握手一次
+    unique_domains = dict.fromkeys(domains)
+    results = await asyncio.gather(*(probe(domain) for domain in unique_domains))
+    return dict(results)
+
+
+def get_ssl_cert_fanouts(
+    domains,
+    concurrency=DEFAULT_CONCURRENCY,
+    timeout=DEFAULT_TIMEOUT,
+    max_addresses=DEFAULT_FANOUT_MAX_ADDRESSES,
+):
+    return asyncio.run(
+        fetch_ssl_cert_fanouts(domains, concurrency, timeout, max_addresses)
+    )
@@ -0,0 +1,47 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """執行緒安全的 token bucket，rate 為每秒補充的 token 數，capacity 為可累積的上限。"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def try_acquire(self, tokens=1):
+        # 回傳需要再等待的秒數，0 代表已取得 token
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # 收到 429 時清空 bucket，讓所有使用者一起等待 Retry-After
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def refund(self, tokens=1):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + tokens)
@@ -1,30 +1,203 @@
+import time
 import schedule
-from utils.cert import check_ssl_expiration
-
-
-def perform_ssl_checks(bot, service, chat_id):
-    try:
-        domains_data = service.get_all_domains()
-        for domain_data in domains_data:
-            subdomains_list = domain_data["subdomains"]
-            for subdomain_dict in subdomains_list:
-                subdomain = subdomain_dict["name"]
-                subdomain_status = subdomain_dict["enable"]
-                if subdomain_status == True:
-                    cert_info = service.get_cert_info(subdomain)
-                    # 假設有函數 check_ssl_expiration 來檢查 SSL 證書的到期時間
-                    check_ssl_expiration(subdomain, cert_info)
-        # 通知用戶所有檢查都已完成
-        bot.send_message(chat_id, "所有 domain 的 SSL 到期時間檢查完成。", parse_mode="Markdown")
-    except Exception as e:
-        bot.send_message(chat_id, str(e))  # 處理錯誤，並回報給用戶
-
-
-
-def setup_scheduler(bot, service, chat_id):
-    schedule.every().day.at("09:00").do(
-        perform_ssl_checks,
-        bot,
+from utils.check_pipeline import (
+    deliver_alerts,
+    new_issues,
+    outcome_from_fanout,
+    outcome_from_probe,
+    run_check_pipeline,
+)
+from utils.expiry import group_by_bucket
+from utils.expiry_scheduler import ExpiryScheduler, DAY
+
+
+def probe_subdomains(service, subdomains):
+    issues = new_issues()
+    outcomes = {}
+    # 一次並行取得所有 subdomain 的證書
+    if service.probe_per_ip:
+        for subdomain, fanout in service.get_cert_fanouts(subdomains).items():
+            outcomes[subdomain] = outcome_from_fanout(subdomain, fanout, issues)
+    else:
+        for subdomain, result in service.get_cert_probes(subdomains).items():
+            outcomes[subdomain] = outcome_from_probe(subdomain, result, issues)
+    return outcomes, issues
+
+
+def group_entries_by_target(entries):
+    # 探測目標是 (host, port, SNI)；這裡固定走 443 且 SNI 即 subdomain，所以以 subdomain 為 key
+    domains_by_target = {}
+    for domain, subdomain in entries:
+        domains_by_target.setdefault(subdomain, []).append(domain)
+    return domains_by_target
+
+
+def notify_expiration_buckets(service, buckets, domains_by_target, probed_subdomains):
+    alerts = [
+        (subdomain, domain, expire_at, remaining_days, bucket)
+        for bucket, findings in buckets.items()
+        for subdomain, expire_at, remaining_days in findings
+        for domain in domains_by_target[subdomain]
+    ]
+    alerting = {alert[0] for alert in alerts}
+    resolved = [t for t in probed_subdomains if t not in alerting]
+    deliver_alerts(service, alerts, resolved)
+
+
+def check_targets(service, domains_by_target):
+    targets = list(domains_by_target)
+    # 每個目標只握手一次，再把結果分送回它所屬的每一筆 domain
+    outcomes, issues = probe_subdomains(service, targets)
+    service.record_probe_outcomes(outcomes)
+    failed_subdomains = [t for t in targets if outcomes[t]["expire_at"] is None]
+    probed_subdomains = [t for t in targets if outcomes[t]["expire_at"] is not None]
+    # 整輪結果一次分類到各告警區間
+    buckets = group_by_bucket(
+        probed_subdomains,
+        [outcomes[t]["expire_at"] for t in probed_subdomains],
+        service.alert_thresholds_days,
+    )
+    notify_expiration_buckets(service, buckets, domains_by_target, probed_subdomains)
+    return outcomes, failed_subdomains, issues
+
+
+def run_ssl_checks(service, progress=None):
+    # 完整巡檢走串流 pipeline，邊從 MongoDB 讀取邊探測
+    failed_subdomains, issues = run_check_pipeline(service, progress)
+    return build_check_report(failed_subdomains, issues)
+
+
+def format_endpoint(endpoint):
+    if endpoint["fingerprint"] is None:
+        return f"  {endpoint['ip']}: 握手失敗 ({endpoint['error']})"
+    line = f"  {endpoint['ip']}: {endpoint['not_after']} {endpoint['fingerprint'][:16]}"
+    if not endpoint["verified"]:
+        line += f" (未通過驗證: {endpoint['verify_error']})"
+    return line
+
+
+def has_issues(failed_subdomains, issues):
+    # 部分 IP 連不上只列在報告中，不單獨觸發排程通知
+    return bool(failed_subdomains or issues["divergent"] or issues["unverified"])
+
+
+def build_check_report(failed_subdomains, issues):
+    report = "所有 domain 的 SSL 到期時間檢查完成。"
+    if failed_subdomains:
+        report += f"\n以下 subdomain 無法取得證書：{', '.join(failed_subdomains)}"
+    for subdomain, verify_error in issues["unverified"].items():
+        report += f"\n{subdomain} 證書驗證失敗：{verify_error}"
+    for subdomain, endpoints in issues["divergent"].items():
+        report += f"\n{subdomain} 各 IP 的證書不一致：\n"
+        report += "\n".join(format_endpoint(endpoint) for endpoint in endpoints)
+    for subdomain, endpoints in issues["unreachable"].items():
+        report += f"\n{subdomain} 部分 IP 無法連線：\n"
+        report += "\n".join(format_endpoint(endpoint) for endpoint in endpoints)
+    return report
+
+
+class DueCheckJob:
+    def __init__(
+        self,
+        service,
+        expiry_scheduler,
+        inventory_refresh_seconds=600,
+        error_report_seconds=3600,
+    ):
+        self.service = service
+        self.expiry_scheduler = expiry_scheduler
+        self.inventory_refresh_seconds = inventory_refresh_seconds
+        self.error_report_seconds = error_report_seconds
+        self.domains_by_target = {}
+        self.last_refresh = None
+        self.inventory_version = None
+        self.last_error = None
+        self.last_error_reported_at = None
+
+    def report_error(self, bot, chat_id, message, now):
+        # 每次都記錄，但同樣的錯誤在 error_report_seconds 內只通知群組一次
+        print(message)
+        if (
+            message != self.last_error
+            or self.last_error_reported_at is None
+            or now - self.last_error_reported_at >= self.error_report_seconds
+        ):
+            self.last_error = message
+            self.last_error_reported_at = now
+            try:
+                bot.send_message(chat_id, message)
+            except Exception as e:
+                print(f"發送排程錯誤通知失敗: {e}")
+
+    def refresh_inventory(self, now):
+        # 常駐清單有版本號時，一有變動就立即同步，讀取本身不會查詢 MongoDB
+        version = self.service.get_inventory_version()
+        if (
+            self.last_refresh is None
+            or version is not None
+            and version != self.inventory_version
+            or now - self.last_refresh >= self.inventory_refresh_seconds
+        ):
+            self.domains_by_target = group_entries_by_target(
+                self.service.get_enabled_entries()
+            )
+            self.expiry_scheduler.sync(self.domains_by_target, now)
+            self.last_refresh = now
+            self.inventory_version = version
+
+    def run(self, bot, chat_id):
+        now = time.time()
+        try:
+            self.refresh_inventory(now)
+        except Exception as e:
+            # 讀取清單失敗時沿用上一次的清單繼續檢查，下個 tick 再重試
+            self.report_error(bot, chat_id, f"讀取 domain 清單失敗: {e}", now)
+        # 只把已到期的 subdomain 交給 prober
+        due_subdomains = self.expiry_scheduler.pop_due(now)
+        if not due_subdomains:
+            return
+        rescheduled = set()
+        try:
+            outcomes, failed_subdomains, issues = check_targets(
+                self.service,
+                {
+                    subdomain: self.domains_by_target[subdomain]
+                    for subdomain in due_subdomains
+                },
+            )
+            for subdomain in due_subdomains:
+                self.expiry_scheduler.reschedule(
+                    subdomain, outcomes[subdomain]["expire_at"]
+                )
+                rescheduled.add(subdomain)
+            if has_issues(failed_subdomains, issues):
+                bot.send_message(chat_id, build_check_report(failed_subdomains, issues))
+        except Exception as e:
+            self.report_error(bot, chat_id, f"SSL 排程檢查失敗: {e}", now)
+        finally:
+            # 已從 heap 取出但沒有排回去的 subdomain 以失敗重試處理，否則不會再被檢查
+            for subdomain in due_subdomains:
+                if subdomain not in rescheduled:
+                    self.expiry_scheduler.reschedule(subdomain, None)
+
+
+def setup_scheduler(bot, service, chat_id, scheduler_config=None):
+    scheduler_config = scheduler_config or {}
+    # 檢查頻率與告警共用同一組門檻，調整門檻時不會有區間落在慢速檢查中
+    expiry_scheduler = ExpiryScheduler(
+        thresholds_days=service.alert_thresholds_days,
+        max_interval=scheduler_config.get("max_check_interval_days", 7) * DAY,
+        alert_interval=scheduler_config.get("alert_check_interval_hours", 24) * 3600,
+        retry_interval=scheduler_config.get("retry_interval_seconds", 300),
+    )
+    job = DueCheckJob(
         service,
+        expiry_scheduler,
+        scheduler_config.get("inventory_refresh_seconds", 600),
+    )
+    schedule.every(scheduler_config.get("scheduler_tick_seconds", 60)).seconds.do(
+        job.run,
+        bot,
         chat_id,
     )
+    return job
@@ -0,0 +1,209 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from utils.rate_limit import TokenBucket
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_REPORT = 1
+PRIORITY_ALERT = 2
+MAX_RETRIES = 5
+DEFAULT_SEND_WORKERS = 8
+DEFAULT_CALL_TIMEOUT = 30
+
+
+class RetryAfter(Exception):
+    def __init__(self, seconds):
+        super().__init__(f"Telegram 限流，{seconds} 秒後重試")
+        self.seconds = seconds
+
+
+def retry_after_seconds(error):
+    # 同時支援自行拋出的 RetryAfter 與 telebot 的 ApiTelegramException
+    if isinstance(error, RetryAfter):
+        return error.seconds
+    if getattr(error, "error_code", None) == 429:
+        result_json = getattr(error, "result_json", None) or {}
+        return result_json.get("parameters", {}).get("retry_after", 1)
+    return None
+
+
+class _SendJob:
+    def __init__(self, chat_id, func, args, kwargs, priority):
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.attempts = 0
+        self.future = Future()
+
+
+class TelegramGateway:
+    """
+    所有對外送出的 Telegram 訊息都經過這裡：依優先順序排隊，
+    同時受全域與每個 chat 的 token bucket 限制，收到 429 時依 retry_after 延後重送。
+
+    單一排程 thread 只負責 token bucket 與排隊，取得額度的訊息交給 send worker 送出，
+    某個 chat 的請求卡住時不會擋住其他 chat。
+    """
+
+    def __init__(
+        self,
+        global_rate=30,
+        chat_rate=1,
+        group_rate_per_minute=20,
+        send_workers=DEFAULT_SEND_WORKERS,
+        call_timeout=DEFAULT_CALL_TIMEOUT,
+    ):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate_per_minute / 60
+        self.chat_buckets = {}
+        self.pending = []
+        self.delayed = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.worker = None
+        self.executor = ThreadPoolExecutor(max_workers=send_workers)
+        self.call_timeout = call_timeout
+
+    def chat_bucket(self, chat_id):
+        # send worker 收到 429 時也會查詢，建立 bucket 需要在 lock 內
+        with self.condition:
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                # 群組 chat_id 為負數，Telegram 對群組的限制是每分鐘 20 則
+                if str(chat_id).startswith("-"):
+                    bucket = TokenBucket(self.group_rate, capacity=3)
+                else:
+                    bucket = TokenBucket(self.chat_rate, capacity=3)
+                self.chat_buckets[chat_id] = bucket
+            return bucket
+
+    def start(self):
+        with self.condition:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, daemon=True)
+                self.worker.start()
+
+    def submit(self, chat_id, func, *args, priority=PRIORITY_ALERT, **kwargs):
+        self.start()
+        job = _SendJob(chat_id, func, args, kwargs, priority)
+        with self.condition:
+            heapq.heappush(self.pending, (priority, next(self.sequence), job))
+            self.condition.notify()
+        return job.future
+
+    def call(self, chat_id, func, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        future = self.submit(chat_id, func, *args, priority=priority, **kwargs)
+        try:
+            return future.result(self.call_timeout)
+        except FutureTimeoutError:
+            # 還沒開始送出的訊息直接取消；已在送出或等待 429 重送的仍會在背景完成
+            future.cancel()
+            raise TimeoutError(f"Telegram 在 {self.call_timeout} 秒內沒有完成送出")
+
+    def defer(self, job, seconds):
+        with self.condition:
+            heapq.heappush(
+                self.delayed, (time.monotonic() + seconds, next(self.sequence), job)
+            )
+            self.condition.notify()
+
+    def next_job(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                while self.delayed and self.delayed[0][0] <= now:
+                    _, sequence, job = heapq.heappop(self.delayed)
+                    heapq.heappush(self.pending, (job.priority, sequence, job))
+                if self.pending:
+                    return heapq.heappop(self.pending)[2]
+                timeout = self.delayed[0][0] - now if self.delayed else None
+                self.condition.wait(timeout)
+
+    def run(self):
+        while True:
+            job = self.next_job()
+            if job.future.cancelled():
+                continue
+            # 該 chat 還沒有額度時先延後，讓其他 chat 的訊息繼續送
+            wait = self.chat_bucket(job.chat_id).try_acquire()
+            if wait:
+                self.defer(job, wait)
+                continue
+            wait = self.global_bucket.try_acquire()
+            if wait:
+                self.chat_bucket(job.chat_id).refund()
+                self.defer(job, wait)
+                continue
+            # 排程 thread 本身不做任何網路 I/O
+            self.executor.submit(self.execute, job)
+
+    def execute(self, job):
+        # 第一次送出前才標記為執行中，在這之前呼叫端逾時可以取消
+        if job.attempts == 0 and not job.future.set_running_or_notify_cancel():
+            return
+        try:
+            job.future.set_result(job.func(*job.args, **job.kwargs))
+        except Exception as e:
+            retry_after = retry_after_seconds(e)
+            job.attempts += 1
+            if retry_after is None or job.attempts > MAX_RETRIES:
+                job.future.set_exception(e)
+                return
+            print(f"chat {job.chat_id} 被 Telegram 限流，{retry_after} 秒後重送")
+            self.chat_bucket(job.chat_id).pause(retry_after)
+            self.defer(job, retry_after)
+
+
+class GatewayBot:
+    """包住 telebot.TeleBot，讓 send_message / reply_to 都改走 gateway，其餘屬性直接轉交。"""
+
+    def __init__(self, bot, gateway, priority=PRIORITY_INTERACTIVE):
+        self.bot = bot
+        self.gateway = gateway
+        self.priority = priority
+
+    def __getattr__(self, name):
+        return getattr(self.bot, name)
+
+    def with_priority(self, priority):
+        return GatewayBot(self.bot, self.gateway, priority)
+
+    def send_message(self, chat_id, text, *args, **kwargs):
+        return self.gateway.call(
+            chat_id,
+            self.bot.send_message,
+            chat_id,
+            text,
+            *args,
+            priority=self.priority,
+            **kwargs,
+        )
+
+    def reply_to(self, message, text, *args, **kwargs):
+        return self.gateway.call(
+            message.chat.id,
+            self.bot.reply_to,
+            message,
+            text,
+            *args,
+            priority=self.priority,
+            **kwargs,
+        )
+
+    def edit_message_text(self, text, chat_id, message_id, *args, **kwargs):
+        return self.gateway.call(
+            chat_id,
+            self.bot.edit_message_text,
+            text,
+            chat_id,
+            message_id,
+            *args,
+            priority=self.priority,
+            **kwargs,
+        )
@@ -0,0 +1,138 @@
+import json
+import queue
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telebot.types import Update
+
+DEFAULT_WORKERS = 8
+DEFAULT_QUEUE_SIZE = 256
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # 預設 listen backlog 只有 5，突發流量時連線會被直接 reset
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class WebhookServer:
+    """
+    內嵌的 webhook 接收端：HTTP thread 只負責驗證並放入有上限的佇列，
+    由固定數量的 worker 執行 handler，慢指令不會卡住其他使用者。
+    """
+
+    def __init__(
+        self,
+        bot,
+        host="0.0.0.0",
+        port=8443,
+        path="/telegram",
+        secret_token="",
+        workers=DEFAULT_WORKERS,
+        queue_size=DEFAULT_QUEUE_SIZE,
+    ):
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+        self.updates = queue.Queue(maxsize=queue_size)
+        self.httpd = _HTTPServer((host, port), self.handler_class())
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self, status):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                if self.path != server.path:
+                    return self.reply(404)
+                if (
+                    server.secret_token
+                    and self.headers.get(SECRET_HEADER) != server.secret_token
+                ):
+                    return self.reply(403)
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    update = Update.de_json(self.rfile.read(length).decode("utf-8"))
+                except (ValueError, KeyError, TypeError):
+                    # 不是合法 JSON，或是 JSON 但不是 update（{}、[]、缺少 update_id）
+                    return self.reply(400)
+                if update is None:
+                    return self.reply(400)
+                try:
+                    server.updates.put_nowait(update)
+                except queue.Full:
+                    # 佇列滿時回 503，Telegram 會稍後重送這個 update
+                    return self.reply(503)
+                self.reply(200)
+
+        return Handler
+
+    def work(self):
+        while True:
+            update = self.updates.get()
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                print(f"處理 update {update.update_id} 失敗: {e}")
+
+    def start_workers(self):
+        for _ in range(self.workers):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def register(self, webhook_url):
+        # 有設定對外網址時才向 Telegram 註冊，本機測試時可以略過
+        self.bot.remove_webhook()
+        self.bot.set_webhook(url=webhook_url, secret_token=self.secret_token or None)
+
+    def serve_forever(self):
+        self.start_workers()
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+
+
+def build_command_update(text, chat_id, update_id=1, user_id=None):
+    """組出一個最小的文字訊息 update，供本機測試 webhook 使用。"""
+    user_id = user_id or chat_id
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "test"},
+            "text": text,
+            "entities": [
+                {"type": "bot_command", "offset": 0, "length": len(text.split()[0])}
+            ],
+        },
+    }
+
+
+def post_update(url, update, secret_token=""):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode("utf-8"),
+        headers={"Content-Type": "application/json", SECRET_HEADER: secret_token},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
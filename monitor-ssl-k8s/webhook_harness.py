@@ -0,0 +1,86 @@
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.webhook import WebhookServer, build_command_update, post_update
+
+
+def post_commands(url, commands, secret_token=""):
+    # 每個指令來自不同的 chat，模擬多個使用者同時操作
+    with ThreadPoolExecutor(max_workers=len(commands)) as executor:
+        return list(
+            executor.map(
+                lambda item: post_update(
+                    url,
+                    build_command_update(item[1], 100000 + item[0], item[0] + 1),
+                    secret_token,
+                ),
+                enumerate(commands),
+            )
+        )
+
+
+def run_local(args):
+    import telebot
+
+    # 不連線 Telegram，只量測 update 從送進 webhook 到 handler 開始執行的延遲
+    bot = telebot.TeleBot("0:harness", threaded=False)
+    latencies = {"slow": [], "fast": []}
+    lock = threading.Lock()
+    posted_at = {}
+
+    def record(kind, message):
+        with lock:
+            latencies[kind].append(time.monotonic() - posted_at[message.chat.id])
+
+    @bot.message_handler(commands=["slow"])
+    def handle_slow(message):
+        record("slow", message)
+        time.sleep(args.slow_seconds)
+
+    @bot.message_handler(commands=["fast"])
+    def handle_fast(message):
+        record("fast", message)
+
+    server = WebhookServer(
+        bot, "127.0.0.1", 0, "/telegram", args.secret, args.workers, args.queue_size
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.port}/telegram"
+
+    commands = ["/slow"] * args.slow + ["/fast"] * args.fast
+    now = time.monotonic()
+    for index in range(len(commands)):
+        posted_at[100000 + index] = now
+    statuses = post_commands(url, commands, args.secret)
+    time.sleep(1)
+    server.shutdown()
+    fast = sorted(latencies["fast"]) or [0]
+    handled = len(latencies["slow"]) + len(latencies["fast"])
+    print(f"HTTP 狀態: {sorted(set(statuses))}")
+    print(f"handler 開始執行 {handled}/{len(commands)} 筆")
+    print(f"/fast 延遲中位數 {fast[len(fast) // 2] * 1000:.1f} ms，最大 {fast[-1] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本機對 webhook 送出模擬的 Telegram update")
+    parser.add_argument("--url", help="已啟動的 webhook 網址；未指定時在本機啟動測試用 server")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--command", default="/help")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--slow", type=int, default=4)
+    parser.add_argument("--fast", type=int, default=20)
+    parser.add_argument("--slow-seconds", type=float, default=3)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--queue-size", type=int, default=256)
+    args = parser.parse_args()
+
+    if args.url:
+        statuses = post_commands(args.url, [args.command] * args.users, args.secret)
+        print(f"HTTP 狀態: {statuses}")
+    else:
+        run_local(args)
+
+
+if __name__ == "__main__":
+    main()